@@ -4,6 +4,8 @@ from .version import __version__
 
 from . import (
     core,
+    jobs,
+    scheduler,
     scp,
     configure,
     notes,
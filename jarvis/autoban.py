@@ -6,49 +6,245 @@
 
 import arrow
 import collections
-import fnmatch
+import json
+import pathlib
 import pyscp
 import re
 import threading
+import time
 
-from . import core, lex
+from . import core, db, lex, scheduler, wordfilter
 
 ###############################################################################
 
-PROFANITY = [
-    'bitch', 'fuck', 'asshole', 'penis', 'vagina', 'nigger', 'retard',
-    'faggot', 'chink', 'shit', 'hitler', 'douche', 'bantest']
+CONFIG = core.config.get('autoban') or {}
+PROFANITY = wordfilter.WordFilter.from_file(
+    CONFIG.get('wordlist') or wordfilter.WORDLISTS / 'profanity.txt')
+# join flood protection is only enabled if it is configured
+FLOOD = CONFIG.get('flood')
+CACHE = pathlib.Path(CONFIG.get('cache') or 'banlist.json')
 
 ###############################################################################
 # Helper Functions
 ###############################################################################
 
 
-Ban = collections.namedtuple('Ban', 'names hosts status reason thread')
+Ban = collections.namedtuple('Ban', 'names hosts status reason thread expires')
 
 
-def get_ban_list():
+class BanList:
+    """
+    Ban list of a single channel, compiled for fast lookups.
+
+    Names are kept in a dict, and all host masks are combined into a single
+    regular expression, so that checking a user takes a dict lookup and a
+    single regex match regardless of the size of the list. Bans that have
+    already expired are left out, and the list is recompiled whenever a
+    matching ban is found to have expired since.
+    """
+
+    def __init__(self, bans):
+        self.all = bans
+        self.compile()
+
+    def compile(self):
+        # match is called from the join threads, so the compiled state is
+        # replaced all at once rather than one attribute at a time
+        now = arrow.utcnow().timestamp
+        bans = [b for b in self.all if not b.expires or b.expires >= now]
+        names = {}
+        for ban in bans:
+            for name in ban.names:
+                names.setdefault(name, ban)
+        hosts = [i for b in bans for i in b.hosts]
+        hosts = re.compile('|'.join(
+            '(?:{})'.format(i) for i in hosts)).match if hosts else None
+        self.compiled = bans, names, hosts
+
+    @staticmethod
+    def _find_host(bans, host):
+        # the combined regex only tells whether some ban matched, and
+        # matches are rare, so finding out which one can be slow
+        for ban in bans:
+            if any(re.match(i, host) for i in ban.hosts):
+                return ban
+
+    def match(self, name, host):
+        """Return the active ban matching the user, or None."""
+        bans, names, hosts = self.compiled
+        ban = names.get(name.lower())
+        if not ban and host and hosts and hosts(host):
+            ban = self._find_host(bans, host)
+        if ban and ban.expires and ban.expires < arrow.utcnow().timestamp:
+            self.compile()
+            return self.match(name, host)
+        return ban
+
+
+def fetch_bans():
+    """Download and parse the ban list. Return the rows of each chat."""
     wiki = pyscp.wikidot.Wiki('05command')
     soup = wiki('chat-ban-page')._soup
     tables = soup('table', class_='wiki-content-table')
     bans = {}
     for table in tables:
         chats = table('tr')[0].text.strip().split()
-        rows = table('tr')[2:]
+        rows = list(map(parse_ban, table('tr')[2:]))
         for chat in chats:
-            bans[chat] = list(map(parse_ban, rows))
+            bans[chat] = rows
     return bans
 
 
+def load_cache():
+    """Return the last fetched ban list, or an empty one."""
+    try:
+        with CACHE.open() as file:
+            cached = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    return {chat: [Ban(*i) for i in rows] for chat, rows in cached.items()}
+
+
+def save_cache(bans):
+    temp = CACHE.with_name(CACHE.name + '.tmp')
+    with temp.open('w') as file:
+        json.dump(bans, file)
+    temp.replace(CACHE)
+
+
+def compile_bans(bans):
+    return {chat: BanList(rows) for chat, rows in bans.items()}
+
+
+def refresh_bans():
+    """
+    Fetch the ban list and swap it in. Return whether it succeeded.
+
+    The new list is compiled before it replaces the old one, so lookups
+    running meanwhile always see a complete list. On failure, the old
+    list is kept.
+    """
+    global BANS
+    try:
+        bans = fetch_bans()
+        compiled = compile_bans(bans)
+    except Exception as e:
+        core.log.exception(e)
+        return False
+    BANS = compiled
+    try:
+        save_cache(bans)
+    except OSError as e:
+        core.log.exception(e)
+    return True
+
+
+def start():
+    """Refresh the ban list in the background."""
+    threading.Thread(target=refresh_bans, daemon=True).start()
+
+
+def glob_to_regex(pattern):
+    """Translate a ban mask to a regular expression, like fnmatch does."""
+    special = {'*': '.*', '?': '.'}
+    return ''.join(special.get(i) or re.escape(i) for i in pattern) + r'\Z'
+
+
 def parse_ban(row):
     names, hosts, status, reason, thread = [i.text for i in row('td')]
     names = [i for i in names.strip().lower().split() if 'generic' not in i]
-    hosts = [fnmatch.translate(i) for i in hosts.strip().split()]
-    hosts = [re.compile(i).match for i in hosts]
-    return Ban(names, hosts, status, reason, thread)
+    hosts = [glob_to_regex(i) for i in hosts.strip().split()]
+    try:
+        expires = arrow.get(status, ['M/D/YYYY', 'YYYY-MM-DD']).timestamp
+    except arrow.parser.ParserError:
+        # if we can't parse the time, it's perma
+        expires = None
+    return Ban(names, hosts, status, reason, thread, expires)
+
+
+# the cached list is used until the first refresh finishes, so that a slow
+# or unreachable wiki doesn't block the startup
+BANS = compile_bans(load_cache())
+
+
+def host_pattern(host):
+    """
+    Return the ban mask shared by the similar hosts.
+
+    Addresses are grouped by their /24 network, hostnames by the domain
+    below the first label.
+    """
+    parts = host.split('.')
+    if len(parts) == 4 and all(i.isdigit() for i in parts):
+        return '*!*@{}.*'.format('.'.join(parts[:3]))
+    if len(parts) > 2:
+        return '*!*@*.{}'.format('.'.join(parts[1:]))
+    return '*!*@' + host
+
+
+class JoinTracker:
+    """
+    Sliding window of the recent joins in each channel.
+
+    Joins are counted per host pattern, so detecting a burst of joins from
+    similar hosts takes constant time per join.
+    """
+
+    def __init__(self, window, limit):
+        self.window = window
+        self.limit = limit
+        self.joins = collections.defaultdict(collections.deque)
+        self.counts = collections.defaultdict(collections.Counter)
+
+    def _remove(self, channel, join):
+        key = host_pattern(join[2])
+        self.counts[channel][key] -= 1
+        if not self.counts[channel][key]:
+            del self.counts[channel][key]
+
+    def add(self, channel, nick, host):
+        """
+        Record the join.
 
+        If it completes a burst of joins from similar hosts, return the
+        (nick, host) pairs of the burst, and forget them so that they are
+        reported once.
+        """
+        now = time.monotonic()
+        joins = self.joins[channel]
+        while joins and joins[0][0] < now - self.window:
+            self._remove(channel, joins.popleft())
+        joins.append((now, nick, host))
+        key = host_pattern(host)
+        self.counts[channel][key] += 1
 
-BANS = get_ban_list()
+        if self.counts[channel][key] < self.limit:
+            return None
+        burst = [j for j in joins if host_pattern(j[2]) == key]
+        for join in burst:
+            self._remove(channel, join)
+        self.joins[channel] = collections.deque(
+            j for j in joins if host_pattern(j[2]) != key)
+        return [j[1:] for j in burst]
+
+
+JOINS = JoinTracker(
+    FLOOD.get('window', 10), FLOOD.get('limit', 5)) if FLOOD else None
+
+
+def is_trusted(inp, name):
+    """
+    Check whether the joining user is exempt from the flood protection.
+
+    Users with a privilege level in any of the bot's channels are trusted,
+    and so are the ones who talked in the channel recently, which covers
+    the rejoins after a netsplit.
+    """
+    if any(inp.privileges.values()):
+        return True
+    since = arrow.utcnow().timestamp - FLOOD.get('active', 30) * 86400
+    talker = db.Talker.find_one(channel=inp.channel, user=name.lower())
+    return bool(talker and talker.last >= since)
 
 
 def kick_user(inp, name, message):
@@ -56,12 +252,27 @@ def kick_user(inp, name, message):
     inp.raw(['KICK', inp.channel, name], message)
 
 
+def ban_users(inp, targets, length):
+    for args in scheduler.pack_modes(inp.channel, '+b', targets):
+        inp.raw(args)
+    for target in targets:
+        scheduler.schedule(length, ['MODE', inp.channel, '-b', target])
+
+
 def ban_user(inp, target, length):
-    inp.raw(['MODE', inp.channel, '+b', target])
-    t = threading.Timer(
-        length,
-        lambda: inp.raw(['MODE', inp.channel, '-b', target]))
-    t.start()
+    ban_users(inp, [target], length)
+
+
+def stop_flood(inp, burst):
+    """Lock the channel, and kick and ban everyone in the burst at once."""
+    mode = FLOOD.get('mode', '+R')
+    inp.raw(['MODE', inp.channel, mode])
+    scheduler.schedule(
+        FLOOD.get('lock', 300),
+        ['MODE', inp.channel, '-' + mode[1:]])
+    ban_user(inp, host_pattern(burst[0][1]), 900)
+    for name, _ in burst:
+        kick_user(inp, name, lex.autoban.kick.flood)
 
 ###############################################################################
 # Commands
@@ -72,17 +283,21 @@ def ban_user(inp, target, length):
 @core.command
 def updatebans(inp):
     """Update the ban list."""
-    global BANS
-    try:
-        BANS = get_ban_list()
+    if refresh_bans():
         return lex.updatebans.updated
-    except:
-        return lex.updatebans.failed
+    return lex.updatebans.failed
 
 
 def autoban(inp, name, host):
     inp.user = 'OP Alert'
-    if any(word in name.lower() for word in PROFANITY):
+    burst = None
+    if JOINS and not is_trusted(inp, name):
+        burst = JOINS.add(inp.channel, name, host)
+    if burst:
+        stop_flood(inp, burst)
+        return lex.autoban.flood(count=len(burst))
+
+    if PROFANITY.search(name):
         kick_user(inp, name, lex.autoban.kick.name)
         ban_user(inp, host, 10)
         ban_user(inp, name, 900)
@@ -91,18 +306,8 @@ def autoban(inp, name, host):
     banlist = BANS.get(inp.channel)
     if not banlist:
         return
-    # find if the user is in the banlist
-    bans = [
-        b for b in banlist if name.lower() in b.names or
-        any(pat(host) for pat in b.hosts)]
-    for ban in bans:
-        try:
-            # check if the ban has expired
-            if arrow.get(ban.status, ['M/D/YYYY', 'YYYY-MM-DD']) < arrow.now():
-                continue
-        except arrow.parser.ParserError:
-            # if we can't parse the time, it's perma
-            pass
+    ban = banlist.match(name, host)
+    if ban:
         kick_user(inp, name, lex.autoban.kick.banlist(reason=ban.reason))
         ban_user(inp, host, 900)
         return lex.autoban.banlist(user=name, truename=ban.names[0])
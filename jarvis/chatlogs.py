@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Import and export of IRC logs.
+
+Understands the log formats of weechat, irssi and ZNC. Log files are parsed
+lazily, one line at a time, and inserted into the Message table in large
+batches, so that logs of any size can be imported in constant memory.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import calendar
+import contextlib
+import itertools
+import pathlib
+import re
+import time
+import urllib.parse
+
+from . import db
+
+###############################################################################
+# Parsers
+###############################################################################
+
+NICK = r'[ @+%&~]?([^\s>]+)'
+MONTHS = {
+    m: i for i, m in enumerate(
+        'Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec'.split(), 1)}
+
+WEECHAT = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)\t' + NICK + r'\t(.*)$')
+IRSSI = re.compile(r'^(\d\d):(\d\d)(?::(\d\d))? <' + NICK + r'> (.*)$')
+IRSSI_DATE = re.compile(
+    r'^--- (?:Log opened|Day changed) \w{3} (\w{3}) (\d\d) '
+    r'(?:[\d:]+ )?(\d{4})$')
+ZNC = re.compile(r'^\[(\d\d):(\d\d):(\d\d)\] <' + NICK + r'> (.*)$')
+ZNC_DATE = re.compile(r'(\d{4})-?(\d\d)-?(\d\d)')
+
+# weechat prefixes for joins, parts, actions and other non-messages
+WEECHAT_EVENTS = {'-->', '<--', '--', '*', '=!=', ''}
+
+
+def _timestamp(*fields):
+    return calendar.timegm(tuple(int(i or 0) for i in fields) + (0, 0, 0))
+
+
+def parse_weechat(lines, **kwargs):
+    for line in lines:
+        match = WEECHAT.match(line.rstrip('\n'))
+        if not match or match.group(7) in WEECHAT_EVENTS:
+            continue
+        yield _timestamp(*match.groups()[:6]), match.group(7), match.group(8)
+
+
+def parse_irssi(lines, **kwargs):
+    date = None
+    for line in lines:
+        line = line.rstrip('\n')
+        match = IRSSI_DATE.match(line)
+        if match:
+            month, day, year = match.groups()
+            date = int(year), MONTHS[month], int(day)
+            continue
+        match = IRSSI.match(line)
+        if match and date:
+            hour, minute, second, nick, text = match.groups()
+            yield _timestamp(*date + (hour, minute, second)), nick, text
+
+
+def parse_znc(lines, *, name, **kwargs):
+    """ZNC logs have one file per day, with the date in the file name."""
+    date = ZNC_DATE.search(name)
+    if not date:
+        raise ValueError('No date in the ZNC log file name: ' + name)
+    for line in lines:
+        match = ZNC.match(line.rstrip('\n'))
+        if match:
+            hour, minute, second, nick, text = match.groups()
+            stamp = _timestamp(*date.groups() + (hour, minute, second))
+            yield stamp, nick, text
+
+
+PARSERS = dict(weechat=parse_weechat, irssi=parse_irssi, znc=parse_znc)
+
+
+def parse(paths, fmt, offset=0):
+    """
+    Lazily parse the log files.
+
+    Yields (time, user, text) tuples. Offset is the utc offset of the
+    timestamps in the logs, in hours.
+    """
+    parser = PARSERS[fmt]
+    for path in map(pathlib.Path, paths):
+        with path.open(encoding='utf-8', errors='replace') as file:
+            for stamp, user, text in parser(file, name=path.name):
+                yield stamp - offset * 3600, user.lower(), text
+
+
+###############################################################################
+# Import
+###############################################################################
+
+
+@contextlib.contextmanager
+def without_indexes(database, table):
+    """
+    Drop the table's indexes for the duration of the block.
+
+    Building the indexes once after a bulk insert is much faster than
+    updating them for every inserted row.
+    """
+    indexes = database.execute_sql(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+        "AND tbl_name = ? AND sql IS NOT NULL", (table,)).fetchall()
+    for name, _ in indexes:
+        database.execute_sql('DROP INDEX "{}"'.format(name))
+    try:
+        yield
+    finally:
+        for _, sql in indexes:
+            database.execute_sql(sql)
+        database.execute_sql('ANALYZE "{}"'.format(table))
+
+
+def import_logs(records, channel, batch=50000):
+    """
+    Insert the parsed log records into the Message table.
+
+    Each batch is inserted with a single executemany call inside its own
+    transaction. Yields the running (count, seconds) totals after each
+    batch, so that the caller can report the throughput. The activity
+    rollups of the channel are rebuilt once the import is finished; the
+    channel's gibber chains are left to the caller, see drop_chains.
+    """
+    channel = channel.lower()
+    table = db.Message._meta.db_table
+    sql = (
+        'INSERT INTO "{}" (user, channel, time, text) '
+        'VALUES (?, ?, ?, ?)').format(table)
+    rows = ((user, channel, stamp, text) for stamp, user, text in records)
+
+    count, start = 0, time.time()
+    with without_indexes(db.logdb, table):
+        while True:
+            chunk = list(itertools.islice(rows, batch))
+            if not chunk:
+                break
+            with db.logdb.atomic():
+                db.logdb.get_conn().executemany(sql, chunk)
+            count += len(chunk)
+            yield count, time.time() - start
+
+    db.Activity.rebuild(channel)
+
+
+def drop_chains(channel, modeldir='models'):
+    """
+    Remove the channel's saved gibber chains.
+
+    They are rebuilt from the logs, the imported ones included, when they
+    are next used. This module is used without the running bot, so it
+    can't go through markov.CHAINS; the file names follow markov._path.
+    """
+    modeldir = pathlib.Path(modeldir)
+    if not modeldir.exists():
+        return
+    prefix = urllib.parse.quote(channel.lower(), safe='')
+    for path in modeldir.iterdir():
+        name = path.name
+        for suffix in ('.json.gz', '.log', '.old', '.tmp'):
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        if name == prefix or name.startswith(prefix + '%40'):
+            path.unlink()
+
+
+###############################################################################
+# Export
+###############################################################################
+
+
+def _weechat_lines(records):
+    for stamp, user, text in records:
+        stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(stamp))
+        yield '{}\t{}\t{}\n'.format(stamp, user, text)
+
+
+def _irssi_lines(records):
+    day = None
+    for stamp, user, text in records:
+        moment = time.gmtime(stamp)
+        if moment[:3] != day:
+            day = moment[:3]
+            yield time.strftime('--- Day changed %a %b %d %Y\n', moment)
+        yield '{} <{}> {}\n'.format(
+            time.strftime('%H:%M:%S', moment), user, text)
+
+
+WRITERS = dict(weechat=_weechat_lines, irssi=_irssi_lines)
+
+
+def records(channel, start=None, end=None):
+    """Yield the channel's messages, archives included, oldest first."""
+    for query in reversed(db.find_messages(channel=channel.lower())):
+        model = query.model_class
+        query = model.between(query, start=start, end=end)
+        query = query.select(model.time, model.user, model.text)
+        query = query.order_by(model.time, model.id).tuples()
+        yield from query.iterator()
+
+
+def export_logs(file, channel, fmt='weechat', start=None, end=None):
+    """Stream the channel's logs into the file. Return the line count."""
+    count = 0
+    for count, line in enumerate(
+            WRITERS[fmt](records(channel, start, end)), 1):
+        file.write(line)
+    return count
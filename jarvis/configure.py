@@ -87,3 +87,18 @@ def urbandict(inp, *, value):
 def gibber(inp, *, value):
     """Enable or disable the .gibber command."""
     return _configurable(inp, 'gibber', [True, False], value)
+
+
+@configure.subcommand('retention')
+@core.require(level=4)
+def retention(inp, *, value):
+    """
+    Set the log retention window for this channel.
+
+    Messages older than the given number of days are moved into the log
+    archive. Archived messages are still available to .seen and .gibber.
+
+    Setting the value to 'off' will keep all messages in the live log.
+    """
+    inp.config.retention = value
+    return lex.configure.retention(days=value)
@@ -43,7 +43,27 @@ stats_wiki = pyscp.wikidot.Wiki('scp-stats')
 stats_wiki.auth(config.wiki.name, config.wiki.password)
 
 
+SIGNATURES = {}
+
+
+def _signature(page):
+    """Summarize everything about the page that the author stats depend on."""
+    return (
+        page.title, page.rating, tuple(sorted(page.tags)), page.created,
+        tuple(sorted(page.metadata.items())))
+
+
 def refresh():
+    """
+    Reload the page list.
+
+    Returns the names of the authors whose pages were created, edited,
+    deleted, or had their attribution changed since the previous refresh.
+
+    The first refresh has nothing to compare against and returns an empty
+    set. Changes made while the bot was offline are therefore only picked
+    up the next time the affected pages change.
+    """
     global pages
     global wlpages
     kwargs = dict(body='title created_by created_at rating tags', category='*')
@@ -63,8 +83,24 @@ def refresh():
     pages = ext.PageView(data)
     wiki.metadata.cache_clear()
 
-    if not config.debug:
-        wlpages = ext.PageView(wlwiki.list_pages(**kwargs))
+    if config.debug:
+        return set()
+    wlpages = ext.PageView(wlwiki.list_pages(**kwargs))
+
+    signatures = {p.url: _signature(p) for p in pages}
+    first = not SIGNATURES
+    changed = [
+        (SIGNATURES.get(k), signatures.get(k))
+        for k in set(signatures) | set(SIGNATURES)
+        if signatures.get(k) != SIGNATURES.get(k)]
+    SIGNATURES.clear()
+    SIGNATURES.update(signatures)
+    if first:
+        return set()
+    # the last item of the signature is the page's attribution metadata
+    return {
+        user for sigs in changed for sig in sigs if sig
+        for user, _ in sig[-1]}
 
 
 refresh()
@@ -126,7 +162,8 @@ class CachedConfig:
         lcratings=True,
         keeplogs=True,
         urbandict=True,
-        gibber=True)
+        gibber=True,
+        retention=None)
 
     def __init__(self, channel, user):
         self.channel, self.user = channel, user
@@ -4,9 +4,129 @@
 # Module Imports
 ###############################################################################
 
+import arrow
+import collections
+import contextlib
+import datetime
+import functools
+import os
 import peewee
 import playhouse.sqlite_ext
 import playhouse.migrate
+import threading
+import time
+import urllib.request
+import zlib
+
+
+###############################################################################
+# Connection Management
+###############################################################################
+
+
+PRAGMAS = collections.OrderedDict([
+    ('synchronous', 'NORMAL'),
+    ('mmap_size', 64 * 2 ** 20),
+    ('cache_size', -8000),
+    ('temp_store', 'MEMORY')])
+
+
+class Database(playhouse.sqlite_ext.SqliteExtDatabase):
+    """
+    SQLite database with per-thread connections and tuned pragmas.
+
+    Every thread gets its own read-write connection. Inside the reading()
+    context, the thread's queries go to a separate read-only connection
+    instead, so that the query commands never compete with the logging
+    for the write lock.
+
+    Statements that fail because the database is locked are retried with
+    an exponential backoff, unless they're part of a larger transaction.
+    """
+
+    def __init__(self, database, **kwargs):
+        self.pragmas = collections.OrderedDict(PRAGMAS)
+        self.retries = 5
+        self._readers = threading.local()
+        super().__init__(
+            database, threadlocals=True, journal_mode='WAL', **kwargs)
+
+    def init(self, database, pragmas=None, timeout=30, **kwargs):
+        self.pragmas = collections.OrderedDict(PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.pragmas['busy_timeout'] = int(timeout * 1000)
+        self._readers = threading.local()
+        super().init(database, timeout=timeout, **kwargs)
+
+    def _connect(self, database, **kwargs):
+        conn = super()._connect(database, **kwargs)
+        for key, value in self.pragmas.items():
+            conn.execute('PRAGMA {} = {}'.format(key, value))
+        return conn
+
+    def get_conn(self):
+        if not getattr(self._readers, 'depth', 0):
+            return super().get_conn()
+        if getattr(self._readers, 'conn', None) is None:
+            path = urllib.request.pathname2url(os.path.abspath(self.database))
+            self._readers.conn = self._connect(
+                'file:{}?mode=ro'.format(path), uri=True,
+                **self.connect_kwargs)
+        return self._readers.conn
+
+    @contextlib.contextmanager
+    def reading(self):
+        """Route the current thread's queries to the read-only connection."""
+        depth = getattr(self._readers, 'depth', 0)
+        if self.database != ':memory:':
+            self._readers.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._readers.depth = depth
+
+    def execute_sql(self, sql, params=None, require_commit=True):
+        for attempt in range(self.retries):
+            try:
+                return super().execute_sql(sql, params, require_commit)
+            except peewee.OperationalError as e:
+                if ('locked' not in str(e) or self.transaction_depth() or
+                        attempt == self.retries - 1):
+                    raise
+                time.sleep(0.05 * 2 ** attempt)
+
+
+def readonly(func):
+    """Run the decorated function on the read-only connections."""
+    @functools.wraps(func)
+    def inner(*args, **kwargs):
+        with db.reading(), logdb.reading():
+            return func(*args, **kwargs)
+    return inner
+
+
+###############################################################################
+# Time Conversion
+###############################################################################
+
+
+def to_timestamp(value):
+    """Convert arrow, datetime, or date string values to unix time."""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, datetime.date) and not isinstance(
+            value, datetime.datetime):
+        value = datetime.datetime(value.year, value.month, value.day)
+    return arrow.get(value).timestamp
+
+
+class EpochField(peewee.IntegerField):
+    """Time stored as an integer unix timestamp."""
+
+    def db_value(self, value):
+        return super().db_value(to_timestamp(value))
 
 
 ###############################################################################
@@ -14,7 +134,8 @@ import playhouse.migrate
 ###############################################################################
 
 
-db = playhouse.sqlite_ext.SqliteExtDatabase(None, journal_mode='WAL')
+db = Database(None)
+logdb = Database(None)
 
 
 class BaseModel(peewee.Model):
@@ -33,12 +154,14 @@ class BaseModel(peewee.Model):
     @classmethod
     def _apply_rules(cls, query, **rules):
         for column, value in rules.items():
-            if column.endswith('_lower'):
+            lower = column.endswith('_lower')
+            if lower:
                 column = column[:-6]
-                column = cls._meta.fields[column]
+            column = cls._meta.fields[column]
+            if isinstance(column, ArchiveTextField):
+                column = peewee.fn.unarchive(column)
+            if lower:
                 column = peewee.fn.Lower(column)
-            else:
-                column = cls._meta.fields[column]
 
             query = query.where(column == value)
         return query
@@ -60,6 +183,26 @@ class BaseModel(peewee.Model):
         query = cls.delete()
         return cls._apply_rules(query, **rules).execute()
 
+    @classmethod
+    def between(cls, query, start=None, end=None, column='time'):
+        """
+        Restrict the query to the given time range.
+
+        Start is inclusive and end is exclusive. Both can be anything
+        accepted by to_timestamp.
+        """
+        column = cls._meta.fields[column]
+        if start is not None:
+            query = query.where(column >= to_timestamp(start))
+        if end is not None:
+            query = query.where(column < to_timestamp(end))
+        return query
+
+    @staticmethod
+    def to_arrow(value):
+        """Convert a stored timestamp to an arrow object."""
+        return arrow.get(value) if value is not None else None
+
     class Meta:
         """Bind Model definitions to the database."""
 
@@ -73,25 +216,131 @@ class Tell(BaseModel):
     recipient = peewee.CharField(index=True)
     topic = peewee.CharField(null=True)
     text = peewee.TextField()
-    time = peewee.DateTimeField()
+    time = EpochField()
 
 
-class Message(BaseModel):
+class LogModel(BaseModel):
+    """
+    Base class for the message logs and the tables derived from them.
+
+    Log tables can be kept in a separate database file, so that the log
+    write bursts and checkpoints do not interfere with the small tables.
+    """
+
+    class Meta:
+        database = logdb
+
+
+class Message(LogModel):
     """Database Message Table."""
 
     user = peewee.CharField(index=True, null=True)
     channel = peewee.CharField(index=True)
-    time = peewee.DateTimeField()
+    time = EpochField()
     text = peewee.TextField()
 
+    class Meta:
+        indexes = (
+            (('channel', 'time'), False),
+            (('channel', 'user', 'time'), False))
+
 
 class Quote(BaseModel):
-    """Database Quote Table."""
+    """
+    Database Quote Table.
+
+    Quotes are numbered in the order of their creation time, both among the
+    quotes of the same user in the same channel (ordinal), and among all
+    the quotes in the channel (channel_ordinal). The numbers are kept
+    contiguous by the add and remove methods, so that retrieving a quote
+    by its index is a single indexed lookup.
+    """
 
     user = peewee.CharField(index=True)
     channel = peewee.CharField()
-    time = peewee.DateTimeField()
+    time = EpochField()
     text = peewee.TextField()
+    ordinal = peewee.IntegerField(null=True)
+    channel_ordinal = peewee.IntegerField(null=True)
+
+    _counts = {}
+
+    class Meta:
+        indexes = (
+            (('channel', 'user', 'ordinal'), False),
+            (('channel', 'channel_ordinal'), False),
+            (('channel', 'time'), False))
+
+    @classmethod
+    def total(cls, channel, user=None):
+        """Return the number of quotes, cached per (channel, user) pair."""
+        key = channel, user
+        if key not in cls._counts:
+            rules = dict(channel=channel, user=user) if user else dict(
+                channel=channel)
+            cls._counts[key] = cls.find(**rules).count()
+        return cls._counts[key]
+
+    @classmethod
+    def get_by_index(cls, channel, user, index):
+        if user:
+            return cls.find_one(channel=channel, user=user, ordinal=index)
+        return cls.find_one(channel=channel, channel_ordinal=index)
+
+    @classmethod
+    def _shift(cls, column, offset, start, **rules):
+        column = cls._meta.fields[column]
+        query = cls.update(**{column.name: column + offset})
+        query = cls._apply_rules(query, **rules)
+        query.where(column >= start).execute()
+
+    @classmethod
+    def add(cls, *, user, channel, time, text):
+        """Insert a new quote, renumbering the later quotes if necessary."""
+        with db.atomic():
+            earlier = cls.select().where(
+                cls.channel == channel, cls.time <= time)
+            ordinal = earlier.where(cls.user == user).count() + 1
+            channel_ordinal = earlier.count() + 1
+            cls._shift('ordinal', 1, ordinal, channel=channel, user=user)
+            cls._shift(
+                'channel_ordinal', 1, channel_ordinal, channel=channel)
+            quote = cls.create(
+                user=user, channel=channel, time=time, text=text,
+                ordinal=ordinal, channel_ordinal=channel_ordinal)
+        for key in [(channel, user), (channel, None)]:
+            if key in cls._counts:
+                cls._counts[key] += 1
+        return quote
+
+    def remove(self):
+        """Delete the quote, and close the gap in the numbering."""
+        with db.atomic():
+            self.delete_instance()
+            self._shift(
+                'ordinal', -1, self.ordinal + 1,
+                channel=self.channel, user=self.user)
+            self._shift(
+                'channel_ordinal', -1, self.channel_ordinal + 1,
+                channel=self.channel)
+        for key in [(self.channel, self.user), (self.channel, None)]:
+            if key in self._counts:
+                self._counts[key] -= 1
+
+    @classmethod
+    def renumber(cls):
+        """Assign ordinals to all quotes from scratch."""
+        users, channels = collections.Counter(), collections.Counter()
+        query = cls.select().order_by(cls.time, cls.id)
+        with db.atomic():
+            for quote in query:
+                users[quote.channel, quote.user] += 1
+                channels[quote.channel] += 1
+                cls.update(
+                    ordinal=users[quote.channel, quote.user],
+                    channel_ordinal=channels[quote.channel]).where(
+                    cls.id == quote.id).execute()
+        cls._counts.clear()
 
 
 class Memo(BaseModel):
@@ -119,9 +368,12 @@ class Alert(BaseModel):
     """Database Alert Table."""
 
     user = peewee.CharField(index=True)
-    time = peewee.DateTimeField()
+    time = EpochField()
     text = peewee.TextField()
 
+    class Meta:
+        indexes = ((('user', 'time'), False),)
+
 
 class ChannelConfig(BaseModel):
 
@@ -131,24 +383,510 @@ class ChannelConfig(BaseModel):
     keeplogs = peewee.BooleanField(null=True)
     urbandict = peewee.BooleanField(null=True)
     gibber = peewee.BooleanField(null=True)
+    retention = peewee.IntegerField(null=True)
+
+
+class ImageRecord(BaseModel):
+    """Local copy of the Image Team's image index."""
+
+    url = peewee.CharField()
+    page = peewee.CharField(index=True)
+    category = peewee.CharField(index=True)
+    source = peewee.CharField(null=True)
+    status = peewee.CharField(null=True)
+    notes = peewee.TextField(null=True)
+
+
+class ImageCategory(BaseModel):
+    """
+    Image index categories.
+
+    Revision is the number of the last revision of the category's index
+    page on the wiki which is reflected in the local copy. Hash is the hash
+    of the index page source as it was last saved or loaded, so that the
+    local changes which weren't saved yet can be told apart.
+    """
+
+    name = peewee.CharField(unique=True)
+    claim = peewee.CharField(null=True)
+    revision = peewee.IntegerField(null=True)
+    hash = peewee.CharField(null=True)
+
+
+class Job(BaseModel):
+    """
+    Queued wiki write operation.
+
+    Jobs are executed one step at a time. Step is the number of steps that
+    have already been completed, so that an interrupted job can be resumed.
+    """
+
+    kind = peewee.CharField()
+    args = peewee.TextField()
+    user = peewee.CharField()
+    channel = peewee.CharField()
+    status = peewee.CharField(default='pending')
+    step = peewee.IntegerField(default=0)
+    steps = peewee.IntegerField(null=True)
+    attempts = peewee.IntegerField(default=0)
+    error = peewee.TextField(null=True)
+    time = EpochField()
+    retry = EpochField()
+
+    class Meta:
+        indexes = ((('status', 'retry'), False),)
+
+
+class AuthorPage(BaseModel):
+    """Author stats pages, with the hash of their last uploaded source."""
+
+    name = peewee.CharField(unique=True)
+    url = peewee.CharField()
+    hash = peewee.CharField()
+
+
+class Action(BaseModel):
+    """Pending timed IRC command, such as the removal of a temporary ban."""
+
+    time = EpochField(index=True)
+    args = peewee.TextField()
+    text = peewee.TextField(null=True)
+
+
+class Member(BaseModel):
+    """
+    Local index of the site's member list.
+
+    Position is the zero-based join order of the member, and page is the
+    member list page on which the member appears.
+    """
+
+    user = peewee.CharField(unique=True)
+    page = peewee.IntegerField(index=True)
+    position = peewee.IntegerField()
+
+
+###############################################################################
+# Log Archive
+###############################################################################
+
+
+ARCHIVE_PREFIX = 'message_archive_'
+ARCHIVES = None
+
+
+@logdb.func('unarchive', 1)
+def unarchive(value):
+    """
+    Decompress the archived message text, if it was compressed.
+
+    Also available in SQL, so that the archived text can be searched:
+    unarchive(text) LIKE '%word%'.
+    """
+    if isinstance(value, bytes):
+        value = zlib.decompress(value).decode('utf-8')
+    return value
+
+
+class ArchiveTextField(peewee.TextField):
+    """Text field that transparently decompresses zlib-compressed values."""
+
+    def python_value(self, value):
+        return super().python_value(unarchive(value))
+
+
+class ArchivedMessage(LogModel):
+    """Base class for the monthly Message archive tables."""
+
+    user = peewee.CharField(index=True, null=True)
+    channel = peewee.CharField(index=True)
+    time = EpochField(index=True)
+    text = ArchiveTextField()
+
+
+def _archive_model(month):
+
+    class Meta:
+        db_table = ARCHIVE_PREFIX + month
+
+    return type(
+        'MessageArchive' + month,
+        (ArchivedMessage,),
+        {'Meta': Meta, '__module__': __name__})
+
+
+def _archive_models():
+    """Get the archive models, discovering existing tables on first use."""
+    global ARCHIVES
+    if ARCHIVES is None:
+        ARCHIVES = {}
+        for table in logdb.get_tables():
+            if table.startswith(ARCHIVE_PREFIX):
+                month = table[len(ARCHIVE_PREFIX):]
+                ARCHIVES[month] = _archive_model(month)
+    return ARCHIVES
+
+
+def archive(month):
+    """Get the archive table for the given 'YYYY_MM' month."""
+    models = _archive_models()
+    if month not in models:
+        models[month] = _archive_model(month)
+    return models[month]
+
+
+def archives():
+    """Return all existing archive tables, oldest first."""
+    models = _archive_models()
+    return [models[k] for k in sorted(models)]
+
+
+def find_messages(**rules):
+    """
+    Find logged messages, including the archived ones.
+
+    Returns a list of queries: one for the live Message table, followed by
+    one for each archive table, from the newest to the oldest. Rules on the
+    text also match the compressed archived messages.
+    """
+    models = [Message] + list(reversed(archives()))
+    return [model.find(**rules) for model in models]
+
+
+def archive_messages(channel, before, compress=False, chunk=5000):
+    """
+    Move messages older than the given timestamp into the archive tables.
+
+    Messages are moved in chunks, each in its own transaction, so that the
+    log table is never locked for long. If compress is True, message text
+    is stored zlib-compressed; SQL which matches on the text has to go
+    through the unarchive function. Returns the number of archived
+    messages.
+    """
+    query = (
+        Message.select(
+            Message.id, Message.user, Message.channel,
+            Message.time, Message.text)
+        .where(Message.channel == channel, Message.time < before)
+        .order_by(Message.id)
+        .limit(chunk)
+        .tuples())
+
+    total = 0
+    while True:
+        rows = list(query.clone())
+        if not rows:
+            return total
+
+        months = {}
+        for _, user, chan, stamp, text in rows:
+            month = time.strftime('%Y_%m', time.gmtime(int(stamp)))
+            if compress:
+                text = zlib.compress(text.encode('utf-8'))
+            months.setdefault(month, []).append((user, chan, stamp, text))
+
+        with logdb.atomic():
+            for month, values in months.items():
+                model = archive(month)
+                model.create_table(fail_silently=True)
+                sql = (
+                    'INSERT INTO "{}" (user, channel, time, text) '
+                    'VALUES (?, ?, ?, ?)').format(model._meta.db_table)
+                logdb.get_conn().executemany(sql, values)
+            Message.delete().where(
+                Message.channel == channel,
+                Message.time < before,
+                Message.id <= rows[-1][0]).execute()
+        total += len(rows)
+
+
+def maintenance(vacuum=False):
+    """Checkpoint the write-ahead logs and refresh the query planner stats."""
+    for database in {db.database: db, logdb.database: logdb}.values():
+        database.execute_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+        database.execute_sql('ANALYZE')
+        if vacuum:
+            database.execute_sql('VACUUM')
+
+
+###############################################################################
+# Activity Rollups
+###############################################################################
+
+
+NICK = None
+
+
+class Activity(LogModel):
+    """
+    Number of messages said by each user in each channel, per hour.
+
+    Hours are stored as the timestamp of their start. The rollups are kept
+    up to date as the messages are logged, and are not affected by the
+    archival of the logs. The bot's own lines are not counted.
+    """
+
+    channel = peewee.CharField()
+    user = peewee.CharField()
+    hour = EpochField()
+    count = peewee.IntegerField(default=0)
+
+    class Meta:
+        indexes = ((('channel', 'hour', 'user'), True),)
+
+    @classmethod
+    def record(cls, channel, user, time):
+        """Count a single logged message."""
+        hour = time - time % 3600
+        logdb.execute_sql(
+            'INSERT OR IGNORE INTO activity (channel, user, hour, count) '
+            'VALUES (?, ?, ?, 0)', (channel, user, hour))
+        logdb.execute_sql(
+            'UPDATE activity SET count = count + 1 '
+            'WHERE channel = ? AND user = ? AND hour = ?',
+            (channel, user, hour))
+        logdb.execute_sql(
+            'INSERT OR IGNORE INTO talker (channel, user, first, last, count) '
+            'VALUES (?, ?, ?, ?, 0)', (channel, user, time, time))
+        logdb.execute_sql(
+            'UPDATE talker SET last = ?, count = count + 1 '
+            'WHERE channel = ? AND user = ?', (time, channel, user))
+
+    @classmethod
+    def rebuild(cls, channel=None):
+        """Recompute the rollups from the live and archived logs."""
+        tables = [Message] + archives()
+        where, args = 'WHERE user IS NOT NULL', ()
+        if NICK:
+            where, args = where + ' AND user != ?', args + (NICK,)
+        if channel:
+            where, args = where + ' AND channel = ?', args + (channel,)
+        messages = ' UNION ALL '.join(
+            'SELECT channel, user, time FROM "{}" {}'.format(
+                i._meta.db_table, where) for i in tables)
+        params = args * len(tables)
+
+        with logdb.atomic():
+            for model in (cls, Talker):
+                query = model.delete()
+                if channel:
+                    query = query.where(model.channel == channel)
+                query.execute()
+            logdb.execute_sql(
+                'INSERT INTO activity (channel, user, hour, count) '
+                'SELECT channel, user, time - time % 3600, COUNT(*) '
+                'FROM ({}) GROUP BY 1, 2, 3'.format(messages), params)
+            logdb.execute_sql(
+                'INSERT INTO talker (channel, user, first, last, count) '
+                'SELECT channel, user, MIN(time), MAX(time), COUNT(*) '
+                'FROM ({}) GROUP BY 1, 2'.format(messages), params)
+
+
+class Talker(LogModel):
+    """First and last message time and message count of each user."""
+
+    channel = peewee.CharField()
+    user = peewee.CharField()
+    first = EpochField()
+    last = EpochField()
+    count = peewee.IntegerField(default=0)
+
+    class Meta:
+        indexes = (
+            (('channel', 'user'), True),
+            (('channel', 'first'), False))
 
 
 ###############################################################################
+# Migrations
+###############################################################################
+
+
+MIGRATIONS = collections.OrderedDict([('main', []), ('logs', [])])
+
+
+def migration(name):
+    """
+    Register the next schema migration of the database.
+
+    Migrations are applied in the order of registration, and must never be
+    reordered or removed once released. Since the first migration creates
+    the tables from the current model definitions, the later ones must
+    check whether their changes are already present.
+    """
+    def decorator(func):
+        MIGRATIONS[name].append(func)
+        return func
+    return decorator
+
 
+def _add_column(database, table, name, field):
+    if name in [i.name for i in database.get_columns(table)]:
+        return
+    migrator = playhouse.migrate.SqliteMigrator(database)
+    playhouse.migrate.migrate(migrator.add_column(table, name, field))
 
-def init(path):
-    """Initialize the database, create missing tables."""
-    db.init(path)
 
+def _add_index(database, table, columns):
+    name = '_'.join((table,) + columns)
+    if name in [i.name for i in database.get_indexes(table)]:
+        return
+    database.execute_sql('CREATE INDEX "{}" ON "{}" ({})'.format(
+        name, table, ', '.join('"{}"'.format(i) for i in columns)))
+
+
+def schema_version(database, name):
     try:
-        migrator = playhouse.migrate.SqliteMigrator(db)
-        playhouse.migrate.migrate(
-            migrator.add_column(
-                'ChannelConfig', 'gibber', peewee.BooleanField(null=True)))
+        row = database.execute_sql(
+            'SELECT version FROM schemaversion WHERE name = ?',
+            (name,)).fetchone()
     except peewee.OperationalError:
-        pass
-
-    db.connect()
+        database.execute_sql(
+            'CREATE TABLE schemaversion ('
+            'name VARCHAR(255) NOT NULL PRIMARY KEY, '
+            'version INTEGER NOT NULL)')
+        row = None
+    return row[0] if row else 0
+
+
+def migrate(database, name):
+    """Apply the pending migrations. Return the number of applied ones."""
+    migrations = MIGRATIONS[name]
+    version = schema_version(database, name)
+    for number, func in enumerate(migrations[version:], version + 1):
+        with database.atomic():
+            func()
+            database.execute_sql(
+                'INSERT OR REPLACE INTO schemaversion (name, version) '
+                'VALUES (?, ?)', (name, number))
+    return len(migrations) - version
+
+
+@migration('main')
+def _create_tables():
     db.create_tables([
-        Tell, Message, Quote, Memo,
+        Tell, Quote, Memo,
         Subscriber, Restricted, Alert, ChannelConfig], safe=True)
+    _add_column(db, 'channelconfig', 'gibber', peewee.BooleanField(null=True))
+
+
+@migration('main')
+def _add_retention():
+    _add_column(
+        db, 'channelconfig', 'retention', peewee.IntegerField(null=True))
+
+
+def _convert_times(table):
+    # the time columns used to be DATETIME, and quote times in particular
+    # were stored as 'YYYY-MM-DD' strings, which an EpochField can't read
+    db.execute_sql(
+        "UPDATE {} SET time = CAST(strftime('%s', time) AS INTEGER) "
+        "WHERE typeof(time) = 'text'".format(table))
+
+
+@migration('main')
+def _add_quote_ordinals():
+    _add_column(db, 'quote', 'ordinal', peewee.IntegerField(null=True))
+    _add_column(
+        db, 'quote', 'channel_ordinal', peewee.IntegerField(null=True))
+    _add_index(db, 'quote', ('channel', 'user', 'ordinal'))
+    _add_index(db, 'quote', ('channel', 'channel_ordinal'))
+    # renumbering loads the quotes through the model, so the times must
+    # be converted first
+    _convert_times('quote')
+    Quote.renumber()
+
+
+@migration('main')
+def _use_epoch_times():
+    _convert_times('quote')
+    _add_index(db, 'quote', ('channel', 'time'))
+    _add_index(db, 'alert', ('user', 'time'))
+
+
+@migration('main')
+def _add_image_index():
+    db.create_tables([ImageRecord, ImageCategory], safe=True)
+
+
+@migration('main')
+def _add_jobs():
+    db.create_tables([Job], safe=True)
+
+
+@migration('main')
+def _add_author_pages():
+    db.create_tables([AuthorPage], safe=True)
+
+
+@migration('main')
+def _add_actions():
+    db.create_tables([Action], safe=True)
+
+
+@migration('main')
+def _add_members():
+    db.create_tables([Member], safe=True)
+
+
+@migration('main')
+def _add_image_hashes():
+    _add_column(db, 'imagecategory', 'hash', peewee.CharField(null=True))
+
+
+@migration('main')
+def _convert_tell_alert_times():
+    for table in ('tell', 'alert'):
+        _convert_times(table)
+
+
+@migration('logs')
+def _create_log_tables():
+    logdb.create_tables([Message], safe=True)
+
+
+@migration('logs')
+def _add_message_time_indexes():
+    _add_index(logdb, 'message', ('channel', 'time'))
+    _add_index(logdb, 'message', ('channel', 'user', 'time'))
+
+
+@migration('logs')
+def _add_activity_rollups():
+    logdb.create_tables([Activity, Talker], safe=True)
+    Activity.rebuild()
+
+
+###############################################################################
+
+
+def init(
+        path, pragmas=None, timeout=30, logs=None, log_pragmas=None,
+        nick=None):
+    """
+    Initialize the database, apply pending migrations.
+
+    Pragmas are applied to every new connection, on top of the defaults
+    from PRAGMAS. Timeout is the number of seconds a connection will wait
+    for a lock to be released before giving up.
+
+    If the path to the log database is given, Message and the other log
+    tables are stored there, with their own write-ahead log and pragmas.
+    Otherwise, they share the main database file.
+
+    The nick is the bot's own, whose lines are left out of the activity
+    rollups.
+    """
+    global ARCHIVES, NICK
+    NICK = nick
+    db.init(path, pragmas=pragmas, timeout=timeout)
+    logdb.init(
+        logs or path,
+        pragmas=log_pragmas if logs else pragmas,
+        timeout=timeout)
+    ARCHIVES = None
+
+    db.connect()
+    migrate(db, 'main')
+    logdb.connect()
+    migrate(logdb, 'logs')
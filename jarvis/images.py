@@ -5,13 +5,16 @@
 # Module Imports
 ###############################################################################
 
+import collections
+import concurrent.futures
 import functools
+import hashlib
 import natural.number
 import pyscp
 import re
-import time
+import threading
 
-from . import core, parser, lex, utils
+from . import core, db, jobs, parser, lex, utils
 
 
 ###############################################################################
@@ -25,8 +28,14 @@ scpwiki = pyscp.wikidot.Wiki('scp-wiki')
 scpwiki.auth(core.config.wiki.name, core.config.wiki.password)
 
 
-IMAGES = []
 CLAIMS = {}
+CONFLICTS = {}
+DIRTY = collections.OrderedDict()
+HASHES = {}
+CONFIG = core.config.get('images') or {}
+SAVE_DELAY = CONFIG.get('save_delay', 30)
+SCAN_WORKERS = CONFIG.get('scan_workers', 8)
+LIMITER = utils.RateLimiter(CONFIG.get('request_interval', 0.2))
 STATUS = [
     'PUBLIC DOMAIN',
     'BY-SA CC',
@@ -60,6 +69,8 @@ lex.jinja2.filters['imgstatuscolor'] = imgstatuscolor
 
 class Image:
 
+    __slots__ = ('url', 'page', 'category', 'source', 'status', 'notes')
+
     def __init__(self, url, page, category, **kwargs):
         self.url = url
         self.page = page
@@ -82,29 +93,228 @@ class Image:
         return source.group(1) if source else ''
 
 
+class ImageRegistry:
+    """
+    Indexed collection of the image records.
+
+    Images can be looked up by url, by page url or page name, and by
+    category. Fields that are indexed must be changed through the update
+    method, so that the indexes stay consistent.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._urls = collections.defaultdict(list)
+        self._pages = collections.defaultdict(list)
+        self._categories = collections.defaultdict(list)
+
+    def __iter__(self):
+        for images in list(self._categories.values()):
+            yield from images
+
+    def __len__(self):
+        return sum(len(i) for i in self._categories.values())
+
+    @staticmethod
+    def _keys(image):
+        return {
+            ('_urls', image.url),
+            ('_pages', image.page),
+            ('_pages', image.page_t),
+            ('_categories', image.category)}
+
+    def _index(self, image, keys=None):
+        if keys is None:
+            keys = self._keys(image)
+        for name, key in keys:
+            getattr(self, name)[key].append(image)
+
+    def _unindex(self, image, keys=None):
+        if keys is None:
+            keys = self._keys(image)
+        for name, key in keys:
+            index = getattr(self, name)
+            if image in index.get(key, ()):
+                index[key].remove(image)
+                if not index[key]:
+                    del index[key]
+
+    def add(self, image):
+        self._index(image)
+
+    def remove(self, images):
+        for image in images:
+            self._unindex(image)
+
+    def update(self, image, **fields):
+        """
+        Change the fields of the image and reindex it.
+
+        The image keeps its position under the keys that didn't change, so
+        that the image numbers used by the commands stay the same.
+        """
+        old = self._keys(image)
+        for name, value in fields.items():
+            setattr(image, name, value)
+        new = self._keys(image)
+        self._unindex(image, old - new)
+        self._index(image, new - old)
+
+    def by_url(self, url):
+        images = self._urls.get(url)
+        return images[0] if images else None
+
+    def by_page(self, page):
+        """Find the images on the page, given its url or its name."""
+        return list(self._pages.get(page, ()))
+
+    def by_category(self, category):
+        return list(self._categories.get(category, ()))
+
+    @property
+    def categories(self):
+        return set(self._categories)
+
+    @property
+    def pages(self):
+        """Return the urls of all the pages that have indexed images."""
+        return {i.page for i in self}
+
+
+IMAGES = ImageRegistry()
+
+
+def _parse_category(name, soup):
+    """Parse the image records from the html of the category's index."""
+    claim = soup.find(class_='claim')
+    if claim:
+        CLAIMS[name] = claim.text.split()[-1]
+    else:
+        CLAIMS.pop(name, None)
+    images = []
+    rows = soup('tr')
+    for row, notes in zip(rows[::2], rows[1::2]):
+        url, page, source, status = row('td')
+        url = url.img['src']
+        page = page.a['href']
+        source = source.a['href'] if source('a') else ''
+        status = status.text
+        notes = notes.find('td').text.split('\n')
+        notes = [i for i in notes if i]
+        images.append(Image(url=url, page=page, category=name,
+                            source=source, status=status, notes=notes))
+    return images
+
+
+def _revision(page):
+    return max(i.number for i in page.revisions)
+
+
+def _edited(category, page):
+    """Check if the index page was edited on the wiki since the last sync."""
+    row = db.ImageCategory.find_one(name=category)
+    if not row or row.revision is None:
+        return False
+    return _revision(page) != row.revision
+
+
 def load_images():
-    global IMAGES
-    IMAGES = []
-    soup = wiki('images')._soup
-    for category in soup(class_='collapsible-block'):
-        name = category.find(class_='collapsible-block-link').text
-        claim = category.find(class_='claim')
-        if claim:
-            CLAIMS[name] = claim.text.split()[-1]
-        rows = category('tr')
-        for row, notes in zip(rows[::2], rows[1::2]):
-            url, page, source, status = row('td')
-            url = url.img['src']
-            page = page.a['href']
-            source = source.a['href'] if source('a') else ''
-            status = status.text
-            notes = notes.find('td').text.split('\n')
-            notes = [i for i in notes if i]
-            IMAGES.append(Image(url=url, page=page, category=name,
-                                source=source, status=status, notes=notes))
+    """
+    Load the image index from the local database.
+
+    The index is imported from the wiki if the local copy doesn't exist yet.
+    Categories with changes that weren't saved to the wiki before the last
+    shutdown are marked dirty again.
+    """
+    if not db.ImageCategory.select().exists():
+        sync_images()
+        return
+    IMAGES.clear()
+    CLAIMS.clear()
+    saved = {}
+    for row in db.ImageCategory.select():
+        if row.claim:
+            CLAIMS[row.name] = row.claim
+        saved[row.name] = row.hash
+    for row in db.ImageRecord.select().order_by(db.ImageRecord.id):
+        IMAGES.add(Image(
+            url=row.url, page=row.page, category=row.category,
+            source=row.source, status=row.status,
+            notes=row.notes.split('\n') if row.notes else []))
+    unsaved = []
+    for category in IMAGES.categories:
+        digest = _digest(render_images(category))
+        # categories stored before the hashes were kept are assumed saved
+        HASHES[category] = saved.get(category) or digest
+        if HASHES[category] != digest:
+            unsaved.append(category)
+    if not unsaved:
+        return
+    with WRITER.lock:
+        for category in unsaved:
+            DIRTY.setdefault(category, []).append(
+                ('changes saved after restart', core.config.irc.nick))
+    if SAVE_DELAY:
+        WRITER.schedule()
 
 
-def save_images(category, comment, user):
+def store_images(category, revision=None, digest=None):
+    """
+    Save the category's records into the local database.
+
+    The revision and the hash of the index page are stored if given, when
+    the local copy matches the page on the wiki.
+    """
+    records = [dict(
+        url=i.url, page=i.page, category=category, source=i.source,
+        status=i.status, notes='\n'.join(i.notes))
+        for i in IMAGES.by_category(category)]
+    with db.db.atomic():
+        db.ImageRecord.purge(category=category)
+        for idx in range(0, len(records), 100):
+            db.ImageRecord.insert_many(records[idx:idx + 100]).execute()
+        row, _ = db.ImageCategory.get_or_create(name=category)
+        row.claim = CLAIMS.get(category)
+        if revision is not None:
+            row.revision = revision
+        if digest is not None:
+            row.hash = digest
+        row.save()
+
+
+def sync_images():
+    """
+    Reload the categories whose index pages were edited on the wiki.
+
+    Only the pages whose latest revision differs from the one stored in the
+    local database are downloaded. Returns the number of reloaded categories.
+
+    Reloading a category discards its local changes which couldn't be saved
+    because of a conflicting edit on the wiki.
+    """
+    revisions = {i.name: i.revision for i in db.ImageCategory.select()}
+    count = 0
+    for page in wiki.list_pages(category='images'):
+        name = page.url.split('images:')[-1]
+        page = wiki('images:' + name)
+        revision = _revision(page)
+        if revisions.get(name) == revision:
+            continue
+        soup = page._soup.find(id='page-content')
+        IMAGES.remove(IMAGES.by_category(name))
+        for image in _parse_category(name, soup):
+            IMAGES.add(image)
+        HASHES[name] = _digest(render_images(name))
+        store_images(name, revision, HASHES[name])
+        with WRITER.lock:
+            CONFLICTS.pop(name, None)
+        count += 1
+    return count
+
+
+def render_images(category):
 
     def wtag(name, *data, **kwargs):
         args = []
@@ -115,7 +325,7 @@ def save_images(category, comment, user):
         result.append('[[/{}]]'.format(name))
         return '\n'.join(result)
 
-    images = [i for i in IMAGES if i.category == category]
+    images = IMAGES.by_category(category)
     rows = []
     for image in sorted(images, key=lambda x: x.page):
 
@@ -146,10 +356,111 @@ def save_images(category, comment, user):
         source.append(claim)
 
     source.append(wtag('table', *rows))
-    source = '\n'.join(source)
+    return '\n'.join(source)
+
+
+def _digest(source):
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
 
-    wiki('images:' + category).create(
-        source, category, comment='{}. -{}'.format(comment, user))
+
+def _unique(items):
+    return list(collections.OrderedDict.fromkeys(items))
+
+
+class _Writer:
+    """
+    Debounced writer of the index pages.
+
+    Edits only mark their category as dirty. The dirty pages are written
+    once no further edits were made for SAVE_DELAY seconds, so that a burst
+    of edits to the same category results in a single page save. Pages
+    which fail to save are marked dirty again and retried after another
+    delay.
+
+    Pages which were edited on the wiki since the last sync are not
+    overwritten. Their categories are kept in CONFLICTS until the next sync
+    reloads them from the wiki.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.timer = None
+
+    def schedule(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(SAVE_DELAY, self._flush_later)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def _flush_later(self):
+        try:
+            self.flush()
+        except Exception as e:
+            core.log.exception(e)
+
+    def _conflict(self, category, edits):
+        with self.lock:
+            CONFLICTS.setdefault(category, []).extend(edits)
+        core.log.warning(
+            'Index page of {} was edited on the wiki, not saving it.'.format(
+                category))
+
+    def flush(self):
+        """Write the dirty index pages. Return the number of saved pages."""
+        with self.flushing:
+            with self.lock:
+                if self.timer:
+                    self.timer.cancel()
+                    self.timer = None
+                dirty = list(DIRTY.items())
+                DIRTY.clear()
+
+            count = 0
+            for idx, (category, edits) in enumerate(dirty):
+                source = render_images(category)
+                digest = _digest(source)
+                if HASHES.get(category) == digest:
+                    continue
+                comments = ', '.join(_unique(i for i, _ in edits))
+                users = ', '.join(_unique(i for _, i in edits))
+                page = wiki('images:' + category)
+                try:
+                    if _edited(category, page):
+                        self._conflict(category, edits)
+                        continue
+                    page.create(
+                        source, category,
+                        comment='{}. -{}'.format(comments, users))
+                except Exception:
+                    with self.lock:
+                        for key, value in dirty[idx:]:
+                            DIRTY.setdefault(key, []).extend(value)
+                    if SAVE_DELAY:
+                        self.schedule()
+                    raise
+                HASHES[category] = digest
+                db.ImageCategory.update(
+                    revision=_revision(page), hash=digest).where(
+                    db.ImageCategory.name == category).execute()
+                count += 1
+            return count
+
+
+WRITER = _Writer()
+
+
+def save_images(category, comment, user):
+    """Save the category locally and schedule its index page to be saved."""
+    store_images(category)
+    with WRITER.lock:
+        DIRTY.setdefault(category, []).append((comment, user))
+    if SAVE_DELAY:
+        WRITER.schedule()
+    else:
+        WRITER.flush()
 
 
 def targeted(maxres=None):
@@ -158,12 +469,10 @@ def targeted(maxres=None):
 
         @functools.wraps(fn)
         def inner(inp, *args, target, index, **kwargs):
-            matches = []
-            for img in IMAGES:
-                if target in [img.page, img.page_t]:
-                    matches.append(img)
-                if img.url == target:
-                    return fn(inp, *args, images=[img], **kwargs)
+            img = IMAGES.by_url(target)
+            if img:
+                return fn(inp, *args, images=[img], **kwargs)
+            matches = IMAGES.by_page(target)
             if not matches:
                 inp.multiline = False
                 return lex.images.not_found
@@ -201,9 +510,39 @@ def get_page_category(page):
                 return v
         return 'U-Z'
 
-    if page.url in core.wiki('scp-001').links:
+    if page.url in scp001_links():
         return '001'
 
+
+@functools.lru_cache()
+def scp001_links():
+    return frozenset(core.wiki('scp-001').links)
+
+
+def _scan_page(name):
+    """Fetch the page, return its name, url, category, and image urls."""
+    LIMITER.wait()
+    page = core.wiki(name)
+    category = get_page_category(page)
+    if not category:
+        return page.name, page.url, None, []
+    images = page._soup.find(id='page-content')('img')
+    return page.name, page.url, category, [i['src'] for i in images]
+
+
+def _scan_pages(pages):
+    """
+    Scan the pages concurrently, yield the results as they are finished.
+
+    Yields (page, result, error) tuples, where result is the return value of
+    _scan_page, or None if scanning the page failed with the given error.
+    """
+    with concurrent.futures.ThreadPoolExecutor(SCAN_WORKERS) as pool:
+        futures = {pool.submit(_scan_page, i): i for i in pages}
+        for future in concurrent.futures.as_completed(futures):
+            error = future.exception()
+            yield futures[future], None if error else future.result(), error
+
 ###############################################################################
 # Bot Commands
 ###############################################################################
@@ -226,21 +565,27 @@ def scan(inp, *, pages):
     Scan wiki pages.
 
     Finds all images in the specified pages and adds them to the index.
+    Pages are downloaded concurrently, and the progress is reported after
+    every few pages. Pages that can't be scanned are reported and skipped.
     """
+    scp001_links.cache_clear()
     cats = set()
     counter = 0
-    for page in pages:
-        page = core.wiki(page)
-        cat = get_page_category(page)
-        if not cat:
-            yield lex.images.scan.unknown_category(page=page.name)
+    scanned = _scan_pages(pages)
+    for done, (page, result, error) in enumerate(scanned, 1):
+        if done % 25 == 0 and done < len(pages):
+            yield lex.images.scan.progress(done=done, total=len(pages))
+        if error:
+            core.log.error('Failed to scan {}: {}'.format(page, error))
+            yield lex.images.scan.failed(page=page, error=error)
             continue
-
-        for img in page._soup.find(id='page-content')('img'):
-            if any(i.url == img['src'] for i in IMAGES):
+        name, url, cat, srcs = result
+        if not cat:
+            yield lex.images.scan.unknown_category(page=name)
+        for src in srcs:
+            if IMAGES.by_url(src):
                 continue
-            img = Image(url=img['src'], page=page.url, category=cat)
-            IMAGES.append(img)
+            IMAGES.add(Image(url=src, page=url, category=cat))
             cats.add(cat)
             counter += 1
 
@@ -256,10 +601,8 @@ def scan(inp, *, pages):
 def update(inp, *, images, url, page, source, status, notes):
     """Update image records."""
     image = images[0]
-    if url:
-        image.url = url
-    if page:
-        image.page = page
+    if url or page:
+        IMAGES.update(image, url=url or image.url, page=page or image.page)
     if source:
         image.source = source
     if status:
@@ -316,8 +659,7 @@ def notes(inp, *, images, append, purge, list):
 @targeted()
 def purge(inp, *, images):
     """Delete all records of the image from the index."""
-    global IMAGES
-    IMAGES = [i for i in IMAGES if i not in images]
+    IMAGES.remove(images)
     save_images(images[0].category, 'records purged', inp.user)
     return lex.images.purge(count=len(images))
 
@@ -335,7 +677,7 @@ def search(inp, *, images):
 @images.subcommand('stats')
 def stats(inp, *, category):
     """Show review statistics for an image category."""
-    images = [i for i in IMAGES if i.category == category]
+    images = IMAGES.by_category(category)
     return lex.images.stats(
         count=len(images),
         images=[i for i in images if i.status],
@@ -349,9 +691,29 @@ def sync(inp):
     Reload image index.
 
     Useful when the index page had to be manually edited for any reason.
+    Pending edits are saved first, then the categories whose index pages
+    were edited since the last sync are reloaded. Pending edits to those
+    categories can't be saved without overwriting the manual edits, and
+    are discarded.
     """
-    load_images()
-    return lex.images.sync
+    WRITER.flush()
+    conflicts = sorted(CONFLICTS)
+    return lex.images.sync(count=sync_images(), conflicts=conflicts)
+
+
+@images.subcommand('flush')
+@core.require(channel=core.config.irc.imageteam, level=2)
+def flush(inp):
+    """
+    Save pending index changes.
+
+    Changes to the index pages are normally saved with a short delay, so
+    that several edits can be combined into a single page save.
+    """
+    if not DIRTY:
+        return lex.images.flush.empty
+    return lex.images.flush.done(
+        count=WRITER.flush(), conflicts=sorted(CONFLICTS))
 
 
 @images.subcommand('add')
@@ -375,7 +737,7 @@ def add(inp, *, url, page):
         page = page.group(1)
     page = core.wiki(page)
     category = get_page_category(page)
-    IMAGES.append(Image(url=url, page=page.url, category=category))
+    IMAGES.add(Image(url=url, page=page.url, category=category))
     save_images(category, 'image added', inp.user)
     return lex.images.add.done
 
@@ -401,9 +763,45 @@ def remove_image_component(source, image_url):
     return re.sub(bracketed, '', source)
 
 
+def _removal_texts(page, images, user, unsourced):
+    if not unsourced:
+        post = utils.load_template('image_removal_post', user=user)
+        pm = utils.load_template(
+            'image_removal_pm',
+            page=page.title, images='\n'.join(images), user=user)
+        return post, pm
+    post = lex.templates.unsourced.removal_post._raw
+    post += lex.templates.postfix._raw
+    pm = lex.templates.unsourced.removal_pm._raw
+    pm += lex.templates.postfix._raw
+    return (
+        post.format(user=user),
+        pm.format(page=page.title, images='\n'.join(images), user=user))
+
+
+@jobs.handler('image_removal')
+def _image_removal(page, images, user, unsourced=False):
+    page = scpwiki(page)
+    post, pm = _removal_texts(page, images, user, unsourced)
+
+    def edit():
+        source = page.source
+        for i in images:
+            # the image code is already gone if the step is being retried
+            if i.split('/')[-1] in source:
+                source = remove_image_component(source, i)
+        if source != page.source:
+            page.edit(source, comment='removed image code. -' + user)
+
+    steps = [edit, functools.partial(page._thread.new_post, post)]
+    steps.extend(
+        functools.partial(scpwiki.send_pm, i, pm, title='Image Removal')
+        for i in page.metadata)
+    return steps
+
+
 @images.subcommand('remove')
 @core.require(channel=core.config.irc.imageteam, level=2)
-@core.multiline
 def remove(inp, *, page, images):
     """
     Remove an image from the page.
@@ -415,32 +813,13 @@ def remove(inp, *, page, images):
     Additionally, jarvis will automatically announce image removal via a
     discussion post, and send wikidot PMs to all authors of the page.
 
-    When using this command, please visually confirm afterwards that no
-    elements of the page except the image were removed, and that the
-    formatting of the page is unaffected by the removal.
+    The edits are made in the background, and jarvis will report back once
+    they are done. When using this command, please visually confirm
+    afterwards that no elements of the page except the image were removed,
+    and that the formatting of the page is unaffected by the removal.
     """
-    page = scpwiki(page)
-
-    source = page.source
-    for i in images:
-        source = remove_image_component(source, i)
-    page.edit(source, comment='removed image code. -' + inp.user)
-    yield lex.images.remove.page_edited
-
-    time.sleep(5)
-
-    text = utils.load_template('image_removal_post', user=inp.user)
-    page._thread.new_post(text)
-    yield lex.images.remove.posted
-
-    time.sleep(5)
-
-    text = utils.load_template(
-        'image_removal_pm',
-        page=page.title, images='\n'.join(images), user=inp.user)
-    for i in page.metadata:
-        scpwiki.send_pm(i, text, title='Image Removal')
-    yield lex.images.remove.pm_sent
+    return jobs.submit('image_removal', inp, page=page, images=images,
+                       user=inp.user)
 
 
 @images.subcommand('attribute')
@@ -456,7 +835,7 @@ def attribute(inp, *, page):
     """
     messages = []
     url = core.wiki(page).url
-    images = [i for i in IMAGES if i.page == url]
+    images = IMAGES.by_page(url)
 
     for idx, image in enumerate(images):
         if not image.source or not image.status:
@@ -497,7 +876,7 @@ def claim(inp, *, category, purge):
     Adds a note on the index page indicating that the particular image
     category is being reviewed by the specific user.
     """
-    if not [i for i in IMAGES if i.category == category]:
+    if not IMAGES.by_category(category):
         return lex.images.claim.unknown_category
     if not purge:
         CLAIMS[category] = inp.user
@@ -521,8 +900,8 @@ def tagcc(inp):
     or the BY-SA CC license.
     """
     candidates = []
-    for page in {i.page for i in IMAGES}:
-        images = [i for i in IMAGES if i.page == page]
+    for page in IMAGES.pages:
+        images = IMAGES.by_page(page)
         if all(i.status in ('PUBLIC DOMAIN', 'BY-SA CC') for i in images):
             candidates.append(page)
 
@@ -530,24 +909,30 @@ def tagcc(inp):
         yield lex.images.tagcc.no_candidates
         return
 
+    candidates = set(candidates)
     pages = [p for p in core.pages if p.url in candidates]
     pages = [p for p in pages if '_cc' not in p.tags]
     yield lex.images.tagcc.working(count=len(pages))
 
-    count = 0
+    tagged = []
     for page in pages:
-        images = [i.url for i in IMAGES if i.page == page.url]
+        images = {i.url for i in IMAGES.by_page(page.url)}
         if any(i not in images for i in page.images):
             yield lex.images.tagcc.untracked(page=page.name)
             continue
+        tagged.append((page.name, sorted(page.tags | {'_cc'})))
+
+    if not tagged:
+        yield lex.images.tagcc.no_candidates
+        return
+    yield jobs.submit('tag_cc', inp, pages=tagged)
 
-        tags = page.tags
-        tags.add('_cc')
-        scpwiki(page.name).set_tags(tags)
-        time.sleep(2)
-        count += 1
 
-    yield lex.images.tagcc.finished(count=count)
+@jobs.handler('tag_cc')
+def _tag_cc(pages):
+    return [
+        functools.partial(scpwiki(name).set_tags, set(tags))
+        for name, tags in pages]
 
 
 #@core.command
@@ -558,34 +943,9 @@ def unsourced(inp, mode, **kwargs):
 
 
 #@unsourced.subcommand('remove')
-@core.multiline
 def unsourced_remove(inp, *, page, images):
-    page = scpwiki(page)
-
-    source = page.source
-    for i in images:
-        source = remove_image_component(source, i)
-    page.edit(source, comment='removed image code. -' + inp.user)
-    yield lex.images.remove.page_edited
-
-    time.sleep(5)
-
-    text = lex.templates.unsourced.removal_post._raw
-    text += lex.templates.postfix._raw
-    text = text.format(user=inp.user)
-    page._thread.new_post(text)
-    yield lex.images.remove.posted
-
-    time.sleep(5)
-
-    text = lex.templates.unsourced.removal_pm._raw
-    text += lex.templates.postfix._raw
-    text = text.format(
-        page=page.title, images='\n'.join(images), user=inp.user)
-    for i in page.metadata:
-        scpwiki.send_pm(i, text, title='Image Removal')
-    yield lex.images.remove.pm_sent
-
+    return jobs.submit('image_removal', inp, page=page, images=images,
+                       user=inp.user, unsourced=True)
 
 
 ###############################################################################
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Background queue for wiki write operations.
+
+Edits, posts and PMs are slow and rate-limited by wikidot, so the commands
+that make them only queue a job and return immediately. Jobs are stored in
+the database and executed one step at a time by a single worker thread,
+which spaces out all the wiki writes and retries the failed steps. Jobs that
+were interrupted by a restart are resumed from the first unfinished step.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import arrow
+import json
+import threading
+
+from . import core, db, lex, parser, utils
+
+###############################################################################
+# Global Variables
+###############################################################################
+
+CONFIG = core.config.get('jobs') or {}
+LIMITER = utils.RateLimiter(CONFIG.get('interval', 5))
+MAX_ATTEMPTS = CONFIG.get('attempts', 5)
+RETRY_DELAY = CONFIG.get('retry_delay', 30)
+
+HANDLERS = {}
+NOTIFY = None
+
+###############################################################################
+# Internal Functions
+###############################################################################
+
+
+def handler(kind):
+    """
+    Register a job handler.
+
+    The handler is called with the job's arguments, and must return a list
+    of callables, one per step. The steps should do their wiki requests only
+    when called, since the list is rebuilt whenever the job is resumed.
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def _notify(job, text):
+    core.log.info('Job #{} ({}): {}'.format(job.id, job.kind, text))
+    if NOTIFY:
+        NOTIFY(job.channel, '{}: {}'.format(job.user, text))
+
+
+class JobQueue:
+
+    def __init__(self):
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._loop, daemon=True)
+            self.thread.start()
+
+    def submit(self, kind, inp, **kwargs):
+        """Queue a new job. Return the job record."""
+        now = arrow.utcnow()
+        job = db.Job.create(
+            kind=kind, args=json.dumps(kwargs), user=inp.user,
+            channel=inp.channel, time=now, retry=now)
+        self.wakeup.set()
+        self.start()
+        return job
+
+    def _next(self):
+        query = db.Job.select().where(db.Job.status << ['pending', 'running'])
+        return query.order_by(db.Job.retry, db.Job.id).first()
+
+    def _loop(self):
+        while True:
+            job = self._next()
+            delay = job.retry - arrow.utcnow().timestamp if job else 60
+            if delay > 0:
+                self.wakeup.wait(min(delay, 60))
+                self.wakeup.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                core.log.exception(e)
+
+    def _fail(self, job, error):
+        job.attempts += 1
+        job.error = str(error)
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = 'failed'
+            job.save()
+            _notify(job, lex.jobs.failed(id=job.id, error=job.error))
+            return
+        delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+        job.retry = arrow.utcnow().replace(seconds=delay)
+        job.save()
+
+    def _run(self, job):
+        job.status = 'running'
+        try:
+            steps = HANDLERS[job.kind](**json.loads(job.args))
+        except Exception as e:
+            self._fail(job, e)
+            return
+        job.steps = len(steps)
+        job.save()
+
+        for idx in range(job.step, len(steps)):
+            LIMITER.wait()
+            try:
+                steps[idx]()
+            except Exception as e:
+                self._fail(job, e)
+                return
+            job.step, job.attempts, job.error = idx + 1, 0, None
+            job.save()
+            # report progress about four times per job
+            every = max(job.steps // 4, 1)
+            if job.step % every == 0 and job.step < job.steps:
+                _notify(job, lex.jobs.progress(
+                    id=job.id, step=job.step, steps=job.steps))
+
+        job.status = 'done'
+        job.save()
+        _notify(job, lex.jobs.done(id=job.id, kind=job.kind))
+
+
+QUEUE = JobQueue()
+
+
+def submit(kind, inp, **kwargs):
+    return lex.jobs.queued(id=QUEUE.submit(kind, inp, **kwargs).id)
+
+
+def start():
+    """Start the worker, resuming the unfinished jobs."""
+    QUEUE.start()
+
+
+###############################################################################
+# Bot Commands
+###############################################################################
+
+
+@core.command
+@parser.jobs
+def jobs(inp, *, id):
+    """Show the status of the queued wiki jobs."""
+    if id:
+        job = db.Job.find_one(id=id)
+        if not job:
+            return lex.jobs.not_found
+        jobs = [job]
+    else:
+        jobs = list(db.Job.select().where(
+            db.Job.status << ['pending', 'running', 'failed']).order_by(
+            db.Job.id.desc()).limit(5))
+        if not jobs:
+            return lex.jobs.empty
+    inp.multiline = True
+    return [lex.jobs.status(
+        id=i.id, kind=i.kind, user=i.user, status=i.status,
+        step=i.step, steps=i.steps, error=i.error) for i in jobs]
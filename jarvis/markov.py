@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Incremental markov chains for the .gibber command.
+
+Chains are kept for every channel and for every user in every channel, and
+are updated as the messages are logged. Each chain is persisted as a gzipped
+json snapshot plus an append-only journal of the lines logged since the
+snapshot was taken, so that logging a message costs a single file append.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import bisect
+import collections
+import gzip
+import itertools
+import json
+import os
+import pathlib
+import random
+import threading
+import urllib.parse
+
+from . import core, db
+
+###############################################################################
+# Global Variables
+###############################################################################
+
+BEGIN = '___BEGIN__'
+END = '___END__'
+STATE_SIZE = 2
+
+MODELDIR = pathlib.Path('models')
+
+###############################################################################
+# Chain
+###############################################################################
+
+
+class Chain:
+    """
+    Markov chain which can be extended one line at a time.
+
+    Lines are added by the logging threads while the commands walk the
+    chain, so adding and compiling share a lock. Walks only read the
+    compiled weights, in which every state reachable from a compiled state
+    is compiled too.
+    """
+
+    def __init__(self, model=None):
+        self.model = model or {}
+        self.size = sum(len(i) for i in self.model.values())
+        self.lock = threading.Lock()
+        self._compiled = {}
+        self._stale = set(self.model)
+
+    def add(self, line):
+        words = line.split()
+        if not words:
+            return
+        items = [BEGIN] * STATE_SIZE + words + [END]
+        with self.lock:
+            for idx in range(len(words) + 1):
+                state = tuple(items[idx:idx + STATE_SIZE])
+                follow = items[idx + STATE_SIZE]
+                counts = self.model.setdefault(state, {})
+                if follow not in counts:
+                    self.size += 1
+                counts[follow] = counts.get(follow, 0) + 1
+                self._stale.add(state)
+
+    def compile(self):
+        """
+        Precompute cumulative weights for the states changed since last time.
+
+        Only the states touched by add() are recompiled, so keeping a busy
+        channel's chain compiled is cheap.
+        """
+        with self.lock:
+            for state in self._stale:
+                counts = self.model[state]
+                words = list(counts)
+                weights = list(
+                    itertools.accumulate(counts[i] for i in words))
+                self._compiled[state] = (words, weights)
+            self._stale = set()
+            return self._compiled
+
+    def walk(self, max_chars):
+        """
+        Generate a single line, or None if it would be too long.
+
+        Returns a (words, novel) tuple; the line is novel if at least one of
+        the transitions had more than one possible outcome. Lines that aren't
+        novel are verbatim copies of one of the source lines.
+        """
+        compiled = self.compile()
+        state = (BEGIN,) * STATE_SIZE
+        words, length, novel = [], -1, False
+        while True:
+            choices, weights = compiled[state]
+            if len(choices) > 1:
+                novel = True
+            idx = bisect.bisect(weights, random.random() * weights[-1])
+            word = choices[idx]
+            if word == END:
+                return words, novel
+            length += len(word) + 1
+            if length > max_chars:
+                return None, False
+            words.append(word)
+            state = state[1:] + (word,)
+
+    def make_short_sentence(self, max_chars, tries=10):
+        if not self.model:
+            return None
+        for _ in range(tries):
+            words, novel = self.walk(max_chars)
+            if words and novel:
+                return ' '.join(words)
+
+    def dump(self):
+        with self.lock:
+            return [[list(k), dict(v)] for k, v in self.model.items()]
+
+    @classmethod
+    def load(cls, data):
+        return cls({tuple(k): v for k, v in data})
+
+
+###############################################################################
+# Persistence
+###############################################################################
+
+
+def _path(channel, user, suffix):
+    name = channel if not user else '{}@{}'.format(channel, user)
+    return MODELDIR / (urllib.parse.quote(name, safe='') + suffix)
+
+
+def _save(channel, user, data):
+    """Write the dumped chain as the new snapshot."""
+    if not MODELDIR.exists():
+        MODELDIR.mkdir()
+    path = _path(channel, user, '.json.gz')
+    temp = _path(channel, user, '.tmp')
+    with gzip.open(str(temp), 'wt', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(str(temp), str(path))
+
+
+def _bootstrap(channel, user):
+    """Build the chain from the entire logged history."""
+    chain = Chain()
+    rules = dict(channel=channel, user=user) if user else dict(channel=channel)
+    for query in db.find_messages(**rules):
+        if not user:
+            query = query.where(
+                query.model_class.user != core.config.irc.nick)
+        query = query.select(query.model_class.text).tuples()
+        for text, in query.iterator():
+            chain.add(text)
+    return chain
+
+
+def _load(channel, user):
+    """Read the chain snapshot."""
+    path = _path(channel, user, '.json.gz')
+    with gzip.open(str(path), 'rt', encoding='utf-8') as file:
+        return Chain.load(json.load(file))
+
+
+def _replay(channel, user, chain):
+    """
+    Add the journaled lines to the chain.
+
+    The journal is then set aside as .old, so that the lines logged from
+    now on go to a fresh journal, and is removed by _compact once the new
+    snapshot is saved. An .old journal left over by a crash is replayed
+    too.
+    """
+    old = _path(channel, user, '.old')
+    journal = _path(channel, user, '.log')
+    for path in (old, journal):
+        if path.exists():
+            with path.open(encoding='utf-8') as file:
+                for line in file:
+                    chain.add(line)
+    if journal.exists():
+        os.replace(str(journal), str(old))
+
+
+def _compact(channel, user, data):
+    """Save the snapshot that includes the set aside journal."""
+    _save(channel, user, data)
+    old = _path(channel, user, '.old')
+    if old.exists():
+        old.unlink()
+
+
+###############################################################################
+# Cache
+###############################################################################
+
+
+class ChainCache:
+    """
+    Memory-bounded LRU cache of the loaded chains.
+
+    The size of the cache is measured in the total number of transitions
+    stored by the chains. Only chains that already have a snapshot on disk
+    are journaled; the others will be built from the logs when first used.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.chains = collections.OrderedDict()
+        self.lock = threading.RLock()
+        self.building = collections.defaultdict(threading.Lock)
+        self.pending = {}
+        self.snapshots = set()
+        if MODELDIR.exists():
+            self.snapshots = {i.name for i in MODELDIR.glob('*.json.gz')}
+
+    @property
+    def size(self):
+        return sum(i.size for i in self.chains.values())
+
+    def _has_snapshot(self, channel, user):
+        return _path(channel, user, '.json.gz').name in self.snapshots
+
+    def _insert(self, key, chain):
+        self.chains[key] = chain
+        while len(self.chains) > 1 and self.size > self.limit:
+            self.chains.popitem(last=False)
+
+    def get(self, channel, user):
+        key = channel, user
+        with self.lock:
+            if key in self.chains:
+                self.chains.move_to_end(key)
+                return self.chains[key]
+            building = self.building[key]
+            if not self._has_snapshot(*key):
+                # lines logged during the build are kept until it's done
+                self.pending.setdefault(key, [])
+
+        # reading the snapshot and building the chain from the logs are
+        # slow, so they're done without holding the lock, which would
+        # otherwise block message logging
+        with building:
+            with self.lock:
+                if key in self.chains:
+                    return self.chains[key]
+                snapshot = self._has_snapshot(*key)
+            try:
+                chain = _load(*key) if snapshot else _bootstrap(*key)
+                with self.lock:
+                    if snapshot:
+                        _replay(channel, user, chain)
+                    else:
+                        # a line logged just as the build started may be
+                        # both in the logs and here, which is harmless
+                        for text in self.pending.pop(key, []):
+                            chain.add(text)
+                        for suffix in ('.log', '.old'):
+                            if _path(channel, user, suffix).exists():
+                                _path(channel, user, suffix).unlink()
+                        self.snapshots.add(
+                            _path(channel, user, '.json.gz').name)
+                    data = chain.dump()
+                    self._insert(key, chain)
+                _compact(channel, user, data)
+            finally:
+                with self.lock:
+                    self.pending.pop(key, None)
+                    self.building.pop(key, None)
+            return chain
+
+    def update(self, channel, user, text):
+        """Add the line to the journal, and to the chain if it's loaded."""
+        text = ' '.join(text.split())
+        if not text:
+            return
+        keys = [(channel, user)]
+        if user != core.config.irc.nick:
+            keys.append((channel, None))
+        with self.lock:
+            for key in keys:
+                if key in self.chains:
+                    self.chains[key].add(text)
+                elif key in self.pending:
+                    self.pending[key].append(text)
+                if not self._has_snapshot(*key):
+                    continue
+                with _path(*key, suffix='.log').open(
+                        'a', encoding='utf-8') as file:
+                    file.write(text + '\n')
+
+    def invalidate(self, channel):
+        """Drop all chains for the channel, forcing them to be rebuilt."""
+        with self.lock:
+            for key in [k for k in self.chains if k[0] == channel]:
+                del self.chains[key]
+            if not MODELDIR.exists():
+                return
+            prefix = urllib.parse.quote(channel, safe='')
+            for path in MODELDIR.iterdir():
+                name = path.name
+                for suffix in ('.json.gz', '.log', '.old', '.tmp'):
+                    if name.endswith(suffix):
+                        name = name[:-len(suffix)]
+                if name == prefix or name.startswith(prefix + '%40'):
+                    self.snapshots.discard(path.name)
+                    path.unlink()
+
+
+CHAINS = ChainCache(
+    (core.config.get('gibber') or {}).get('cache_size', 2000000))
@@ -54,9 +54,34 @@ def dispatcher(bot, tr):
     jarvis.core.dispatcher(inp)
 
 
+@sopel.module.event('001')
+@sopel.module.rule('.*')
+def start_workers(bot, tr):
+    jarvis.jobs.NOTIFY = bot.msg
+    jarvis.jobs.start()
+    jarvis.scheduler.start(bot.write)
+    jarvis.autoban.start()
+    jarvis.tools.start_members()
+
+
 @sopel.module.interval(3600)
 def refresh(bot):
-    jarvis.core.refresh()
+    jarvis.stats.update_users(jarvis.core.refresh())
+
+
+@sopel.module.interval(900)
+def update_bans(bot):
+    jarvis.autoban.refresh_bans()
+
+
+@sopel.module.interval(86400)
+def update_members(bot):
+    jarvis.tools.update_members()
+
+
+@sopel.module.interval(86400)
+def archive(bot):
+    jarvis.notes.archive_logs()
 
 
 @sopel.module.interval(28800)
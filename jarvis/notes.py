@@ -10,18 +10,29 @@ logging, tells, and quotes.
 ###############################################################################
 
 import arrow
+import collections
 import functools
 import markovify
+import peewee
 import random
 import re
+import threading
 
-from . import core, lex, parser, db
+from . import core, lex, parser, db, markov
 
 
 ###############################################################################
 
 
-db.init('jarvis.db')
+dbconfig = core.config.get('database') or {}
+logconfig = dbconfig.get('logs') or {}
+db.init(
+    dbconfig.get('path', 'jarvis.db'),
+    pragmas=dbconfig.get('pragmas'),
+    timeout=dbconfig.get('timeout', 30),
+    logs=logconfig.get('path'),
+    log_pragmas=logconfig.get('pragmas'),
+    nick=core.config.irc.nick)
 
 
 @core.rule(r'(.*)')
@@ -29,9 +40,12 @@ def logevent(inp):
     """Log input into the database."""
     if not inp.config.keeplogs:
         return
-    db.Message.create(
-        user=inp.user, channel=inp.channel,
-        time=arrow.utcnow().timestamp, text=inp.text)
+    time = arrow.utcnow().timestamp
+    with db.logdb.atomic():
+        db.Message.create(
+            user=inp.user, channel=inp.channel, time=time, text=inp.text)
+        db.Activity.record(inp.channel, inp.user, time)
+    markov.CHAINS.update(inp.channel, inp.user, inp.text)
 
 
 ###############################################################################
@@ -102,6 +116,7 @@ def get_tells(inp):
 @core.command
 @core.alias('st')
 @core.notice
+@db.readonly
 def showtells(inp):
     """Check for incoming messages."""
     if not db.Tell.find_one(recipient=inp.user):
@@ -152,30 +167,126 @@ def outbound(inp, *, purge, echo):
 @core.command
 @parser.seen
 @core.crosschannel
+@db.readonly
 def seen(inp, *, user, first, total, date):
     """Show the first message said by the user."""
     if user == core.config.irc.nick:
         return lex.seen.self
 
-    query = db.Message.find(user=user, channel=inp.channel)
-    if not query.exists():
+    queries = [
+        q for q in db.find_messages(user=user, channel=inp.channel)
+        if q.exists()]
+    if not queries:
         return lex.seen.never
 
     if total:
-        total = query.count()
+        total = sum(q.count() for q in queries)
         time = arrow.get(arrow.now().format('YYYY-MM'), 'YYYY-MM')
-        this_month = query.where(db.Message.time > time.timestamp).count()
+        this_month = sum(
+            q.model_class.between(q, start=time).count() for q in queries)
         return lex.seen.total(
             user=user, total=total, this_month=this_month)
 
-    seen = query.order_by(
-        db.Message.time if first else db.Message.time.desc()).get()
+    def edge(query):
+        field = query.model_class.time
+        return query.order_by(field if first else field.desc()).get()
+
+    # older logs can be imported into the live table, so the tables can't
+    # be relied on to be in the order of their messages
+    pick = min if first else max
+    seen = pick((edge(q) for q in queries), key=lambda i: i.time)
     time = arrow.get(seen.time)
     time = time.humanize() if not date else 'on {0:YYYY-MM-DD}'.format(time)
     msg = lex.seen.first if first else lex.seen.last
     return msg(user=user, time=time, text=seen.text)
 
 
+def archive_logs():
+    """
+    Move old messages into the monthly archive tables.
+
+    Each channel's retention window is taken from its channel config,
+    falling back to the 'logs.retention' value from the config file.
+    Channels without a retention window keep their logs forever.
+    """
+    settings = core.config.get('logs') or {}
+    channels = {
+        i.channel: i.retention for i in db.ChannelConfig.select()}
+    if settings.get('retention'):
+        query = db.Message.select(db.Message.channel).distinct()
+        for i in query:
+            channels.setdefault(i.channel, None)
+
+    for channel, days in channels.items():
+        if days is None:
+            days = settings.get('retention')
+        if not days:
+            continue
+        before = arrow.utcnow().replace(days=-days).timestamp
+        count = db.archive_messages(
+            channel, before, compress=settings.get('compress', False))
+        if count:
+            core.log.info(
+                'Archived {} messages from {}.'.format(count, channel))
+
+    db.maintenance(vacuum=settings.get('vacuum', False))
+
+
+###############################################################################
+# Activity
+###############################################################################
+
+WEEKDAYS = 'Mon Tue Wed Thu Fri Sat Sun'.split()
+
+
+@core.command
+@parser.activity
+@core.crosschannel
+@db.readonly
+def activity(inp, *, days):
+    """
+    Show the channel activity statistics.
+
+    Only the hourly rollups are queried, so the cost of the command doesn't
+    depend on the size of the logs.
+    """
+    days = days or 30
+    if days < 1:
+        return lex.activity.bad_days
+    start = arrow.utcnow().replace(days=-days).timestamp
+    start -= start % 3600
+
+    rollup = db.Activity
+    query = rollup.between(
+        rollup.find(channel=inp.channel), start=start, column='hour')
+    hours, weekdays = collections.Counter(), collections.Counter()
+    hourly = query.select(rollup.hour, peewee.fn.SUM(rollup.count))
+    for hour, count in hourly.group_by(rollup.hour).tuples():
+        moment = arrow.get(hour)
+        hours[moment.hour] += count
+        weekdays[moment.weekday()] += count
+    if not hours:
+        return lex.activity.empty
+
+    total = peewee.fn.SUM(rollup.count)
+    talkers = (
+        query.select(rollup.user, total).group_by(rollup.user)
+        .order_by(total.desc()).limit(5).tuples())
+    active = query.select(rollup.user).distinct().count()
+    new = db.Talker.between(
+        db.Talker.find(channel=inp.channel), start=start,
+        column='first').count()
+
+    return lex.activity.summary(
+        days=days,
+        total=sum(hours.values()),
+        hours=['{:02}:00'.format(h) for h, _ in hours.most_common(3)],
+        weekdays=[WEEKDAYS[d] for d, _ in weekdays.most_common(3)],
+        talkers=['{} ({})'.format(*i) for i in talkers],
+        new=new,
+        returning=active - new)
+
+
 ###############################################################################
 # Quotes
 ###############################################################################
@@ -204,28 +315,25 @@ def quote(inp, mode, **kwargs):
 
 
 @quote.subcommand()
+@db.readonly
 def get_quote(inp, *, user, index):
     """Retrieve a quote."""
     if index is not None and index <= 0:
         return lex.input.bad_index
 
-    if user:
-        query = db.Quote.find(channel=inp.channel, user=user)
-    else:
-        query = db.Quote.find(channel=inp.channel)
-
-    if not query.exists():
+    total = db.Quote.total(inp.channel, user)
+    if not total:
         return lex.quote.not_found
 
-    index = index or random.randint(1, query.count())
-    if index > query.count():
+    index = index or random.randint(1, total)
+    if index > total:
         return lex.quote.index_error
-    quote = query.order_by(db.Quote.time).limit(1).offset(index - 1)[0]
+    quote = db.Quote.get_by_index(inp.channel, user, index)
 
     return lex.quote.get(
         index=index,
-        total=query.count(),
-        time=str(quote.time)[:10],
+        total=total,
+        time=db.Quote.to_arrow(quote.time).format('YYYY-MM-DD'),
         user=quote.user,
         text=quote.text)
 
@@ -236,10 +344,10 @@ def add_quote(inp, *, date, user, message):
     if db.Quote.find_one(user=user, channel=inp.channel, text=message):
         return lex.quote.already_exists
 
-    db.Quote.create(
+    db.Quote.add(
         user=user,
         channel=inp.channel,
-        time=(date or arrow.utcnow()).format('YYYY-MM-DD'),
+        time=date or arrow.utcnow(),
         text=message)
 
     return lex.quote.added
@@ -254,16 +362,16 @@ def delete_quote(inp, *, user, index):
     accidental deletions, as well as to provide an additional copy of the
     deleted memo for the logs.
     """
-    quote = db.Quote.find(user=user, channel=inp.channel)
-    if not 0 < index - 1 < quote.count():
+    if not 0 < index <= db.Quote.total(inp.channel, user):
         return lex.quote.index_error
-    quote = quote.order_by(db.Quote.time)[index - 1]
+    quote = db.Quote.get_by_index(inp.channel, user, index)
 
     if not quote:
         return lex.quote.delete_not_found
 
-    text, time = quote.text, quote.time
-    quote.delete_instance()
+    text = quote.text
+    time = db.Quote.to_arrow(quote.time).format('YYYY-MM-DD')
+    quote.remove()
     return lex.quote.deleted(text=text, time=time)
 
 
@@ -272,6 +380,59 @@ def delete_quote(inp, *, user, index):
 ###############################################################################
 
 
+class MemoCache:
+    """
+    Write-through cache of the memos.
+
+    All memos of a channel are loaded at once, the first time the channel is
+    accessed. Afterwards, reads never touch the database. When the total
+    number of cached memos exceeds the limit, the least recently used
+    channels are dropped from the cache.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.channels = collections.OrderedDict()
+        self.lock = threading.RLock()
+
+    def _memos(self, channel):
+        with self.lock:
+            if channel in self.channels:
+                self.channels.move_to_end(channel)
+                return self.channels[channel]
+            memos = {i.user: i.text for i in db.Memo.find(channel=channel)}
+            self.channels[channel] = memos
+            while (len(self.channels) > 1 and
+                    sum(map(len, self.channels.values())) > self.limit):
+                self.channels.popitem(last=False)
+            return memos
+
+    def get(self, channel, user):
+        return self._memos(channel).get(user)
+
+    def count(self, channel):
+        return len(self._memos(channel))
+
+    def add(self, channel, user, text):
+        with self.lock:
+            db.Memo.create(user=user, channel=channel, text=text)
+            self._memos(channel)[user] = text
+
+    def update(self, channel, user, text):
+        with self.lock:
+            db.Memo.update(text=text).where(
+                db.Memo.user == user, db.Memo.channel == channel).execute()
+            self._memos(channel)[user] = text
+
+    def delete(self, channel, user):
+        with self.lock:
+            db.Memo.purge(user=user, channel=channel)
+            self._memos(channel).pop(user, None)
+
+
+MEMOS = MemoCache(20000)
+
+
 @core.command
 @parser.memo
 @core.crosschannel
@@ -295,10 +456,10 @@ def memo(inp, mode, **kwargs):
 @memo.subcommand()
 def get_memo(inp, *, user):
     """Retrieve the specified user's memo."""
-    memo = db.Memo.find_one(user=user, channel=inp.channel)
+    text = MEMOS.get(inp.channel, user)
 
-    if memo:
-        return lex.memo.get(user=user, text=memo.text)
+    if text is not None:
+        return lex.memo.get(user=user, text=text)
     else:
         return lex.memo.not_found
 
@@ -314,10 +475,10 @@ def add_memo(inp, *, user, message):
     If you wish to overwrite an old memo, delete it explicitly and add the
     new memo in its place afterwards.
     """
-    if db.Memo.find_one(user=user, channel=inp.channel):
+    if MEMOS.get(inp.channel, user) is not None:
         return lex.memo.already_exists
 
-    db.Memo.create(user=user, channel=inp.channel, text=message)
+    MEMOS.add(inp.channel, user, message)
     return lex.memo.saved
 
 
@@ -330,13 +491,11 @@ def delete_memo(inp, *, user):
     deletions, as well as to provide an additional copy of the deleted memo
     for the logs.
     """
-    memo = db.Memo.find_one(
-        user=user, channel=inp.channel)
-    if not memo:
+    text = MEMOS.get(inp.channel, user)
+    if text is None:
         return lex.memo.not_found
 
-    text = memo.text
-    memo.delete_instance()
+    MEMOS.delete(inp.channel, user)
     return lex.memo.deleted(text=text)
 
 
@@ -348,19 +507,18 @@ def append_memo(inp, *, user, message):
     Adds additional text to the end of the previously stored memo, without
     deletiing the original.
     """
-    memo = db.Memo.find_one(user=user, channel=inp.channel)
-    if not memo:
+    text = MEMOS.get(inp.channel, user)
+    if text is None:
         return lex.memo.not_found
 
-    memo.text += ' ' + message
-    memo.save()
+    MEMOS.update(inp.channel, user, text + ' ' + message)
     return lex.memo.appended
 
 
 @memo.subcommand('count')
 def count_memos(inp):
     """Output the number of memos stored in this channel."""
-    return lex.memo.count(count=db.Memo.find(channel=inp.channel).count())
+    return lex.memo.count(count=MEMOS.count(inp.channel))
 
 
 @core.command
@@ -429,11 +587,12 @@ def alert_set(inp, *, date, span, message):
 @core.multiline
 def get_alerts(inp):
     """Retrieve stored alerts."""
-    now = arrow.utcnow().timestamp
-    where = ((db.Alert.user == inp.user) & (db.Alert.time < now))
-    alerts = [i.text for i in db.Alert.select().where(where)]
-    alerts = [lex.alert.show(text=i) for i in alerts]
-    db.Alert.delete().where(where).execute()
+    now = arrow.utcnow()
+    query = db.Alert.between(db.Alert.find(user=inp.user), end=now)
+    alerts = [lex.alert.show(text=i.text) for i in query]
+    if alerts:
+        db.Alert.between(db.Alert.delete(), end=now).where(
+            db.Alert.user == inp.user).execute()
     return alerts
 
 
@@ -443,18 +602,11 @@ def get_alerts(inp):
 
 
 @functools.lru_cache(maxsize=32)
-def get_text_model(channel, user, quotes):
-    if quotes and user:
+def get_quotes_model(channel, user):
+    if user:
         lines = db.Quote.find(channel=channel, user=user)
-    elif quotes:
-        lines = db.Quote.find(channel=channel)
-    elif user:
-        lines = db.Message.find(channel=channel, user=user)
     else:
-        lines = (
-            db.Message.select()
-            .where(db.Message.channel == channel)
-            .where(db.Message.user != 'jarvis'))
+        lines = db.Quote.find(channel=channel)
     lines = lines.order_by(db.peewee.fn.Random()).limit(1000)
     text = '\n'.join([i.text for i in lines])
     return markovify.NewlineText(text)
@@ -463,6 +615,7 @@ def get_text_model(channel, user, quotes):
 @core.command
 @parser.gibber
 @core.crosschannel
+@db.readonly
 def gibber(inp, user, quotes):
     """
     Generate a message using markov chains, hatbot-like.
@@ -477,12 +630,14 @@ def gibber(inp, user, quotes):
         if user == core.config.irc.nick:
             return lex.gibber.self
 
-        query = db.Message.select().where(
-            db.Message.channel == inp.channel, db.Message.user == user)
-        if user and not query.exists():
+        queries = db.find_messages(channel=inp.channel, user=user)
+        if user and not any(q.exists() for q in queries):
             return lex.gibber.no_such_user
 
-    model = get_text_model(inp.channel, user, quotes)
+    if quotes:
+        model = get_quotes_model(inp.channel, user)
+    else:
+        model = markov.CHAINS.get(inp.channel, user)
     text = model.make_short_sentence(400)
     if not text:
         return lex.gibber.small_sample
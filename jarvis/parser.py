@@ -601,6 +601,22 @@ def alert(pr):
     pr.subparser('echo')
 
 
+@parser
+def activity(pr):
+    pr.add_argument(
+        'channel',
+        re='#',
+        nargs='?',
+        help="""Switch to another channel.""")
+
+    pr.add_argument(
+        '--days', '-d',
+        nargs=1,
+        type=int,
+        help="""Number of past days to include in the statistics.
+                Defaults to 30.""")
+
+
 @parser
 def gibber(pr):
     pr.add_argument(
@@ -620,6 +636,15 @@ def gibber(pr):
         help="""Use quotes instead of history as source of the gib.""")
 
 
+@parser
+def jobs(pr):
+    pr.add_argument(
+        'id',
+        nargs='?',
+        type=int,
+        help="""Show the status of the job with the given number.""")
+
+
 ###############################################################################
 # SCP
 ###############################################################################
@@ -780,7 +805,7 @@ def dice(pr):
     pr.add_argument(
         'throws',
         nargs='+',
-        re=r'(?i)[+-]?[0-9]*d([0-9]+|f)$',
+        re=r'(?i)[+-]?[0-9]*d([0-9]+!?|f)(k[hl]?[0-9]+)?$',
         type=str.lower,
         help="""One or more dice throws to be calculated.""")
 
@@ -819,7 +844,8 @@ def onpage(pr):
 
     pr.add_argument(
         '--oldest-first', '-o',
-        help="""Start the search with oldest users.""")
+        help="""Has no effect, since the member list is now indexed locally.
+                Accepted for compatibility.""")
 
 
 @parser
@@ -1171,6 +1197,8 @@ def images(pr):
 
     pr.subparser('sync')
 
+    pr.subparser('flush')
+
     add = pr.subparser('add')
 
     add.add_argument(
@@ -1257,3 +1285,17 @@ def configure(pr):
             help="""New value of the configured parameter.""")
 
     ###########################################################################
+
+    def retention_days(value):
+        if value.lower() in ['off', 'never', 'forever']:
+            return 0
+        value = int(value)
+        if value < 0:
+            raise ValueError
+        return value
+
+    pr.subparser('retention').add_argument(
+        'value',
+        type=retention_days,
+        help="""Number of days after which messages are archived,
+                or 'off' to keep them in the live log.""")
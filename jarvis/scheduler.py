@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Scheduler for timed IRC commands.
+
+A single thread executes all the scheduled commands, such as removing
+temporary bans, in the order of their due time. Pending commands are stored
+in the database, so that they are executed even if the bot is restarted in
+the meantime. Mode changes that fall due together, like the removal of the
+bans set during a join flood, are packed into multi-target MODE lines.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import arrow
+import collections
+import heapq
+import json
+import threading
+
+from . import core, db
+
+###############################################################################
+
+CONFIG = core.config.get('scheduler') or {}
+# most servers accept at least four mode changes per line; RPL_ISUPPORT
+# MODES tells the real limit, which can be set in the config
+MAX_MODES = CONFIG.get('modes', 4)
+MAX_LENGTH = 400
+
+###############################################################################
+
+
+def pack_modes(channel, mode, targets):
+    """
+    Pack the mode changes into as few MODE commands as the server allows.
+
+    Mode is a single signed mode, such as '+b'. Each command holds at most
+    MAX_MODES targets, and is kept well below the 512 byte line limit.
+    """
+    sign, mode = mode
+    line, length = [], 0
+    for target in targets:
+        if line and (
+                len(line) == MAX_MODES or length + len(target) > MAX_LENGTH):
+            yield ['MODE', channel, sign + mode * len(line)] + line
+            line, length = [], 0
+        line.append(target)
+        length += len(target) + 2
+    if line:
+        yield ['MODE', channel, sign + mode * len(line)] + line
+
+
+def _merge(actions):
+    """Combine single mode changes due at the same time into packed lines."""
+    modes = collections.OrderedDict()
+    for args, text in actions:
+        if args[0] == 'MODE' and len(args) == 4 and len(args[2]) == 2:
+            modes.setdefault((args[1], args[2]), []).append(args[3])
+        else:
+            yield args, text
+    for (channel, mode), targets in modes.items():
+        for args in pack_modes(channel, mode, targets):
+            yield args, None
+
+
+class Scheduler:
+
+    def __init__(self):
+        self.heap = []
+        self.condition = threading.Condition()
+        self.thread = None
+        self.write = None
+
+    def start(self, write):
+        """
+        Start executing the commands with the given irc write function.
+
+        Commands left pending by the previous run are loaded from the
+        database; the ones that are already due are executed right away.
+        """
+        with self.condition:
+            self.write = write
+            queued = {i[1] for i in self.heap}
+            for action in db.Action.select():
+                if action.id not in queued:
+                    heapq.heappush(self.heap, (
+                        action.time, action.id,
+                        json.loads(action.args), action.text))
+            if not self.thread or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._loop, daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def schedule(self, delay, args, text=None):
+        """Execute the irc command after the given number of seconds."""
+        time = arrow.utcnow().timestamp + int(delay)
+        action = db.Action.create(
+            time=time, args=json.dumps(args), text=text)
+        with self.condition:
+            heapq.heappush(self.heap, (time, action.id, args, text))
+            self.condition.notify()
+
+    def _next(self):
+        """Wait until the earliest command is due; take all the due ones."""
+        with self.condition:
+            while True:
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                now = arrow.utcnow().timestamp
+                delay = self.heap[0][0] - now
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                due = []
+                while self.heap and self.heap[0][0] <= now:
+                    due.append(heapq.heappop(self.heap))
+                return due
+
+    def _loop(self):
+        while True:
+            due = self._next()
+            for args, text in _merge((i[2], i[3]) for i in due):
+                try:
+                    self.write(args, text)
+                except Exception as e:
+                    core.log.exception(e)
+            ids = [i[1] for i in due]
+            db.Action.delete().where(db.Action.id << ids).execute()
+
+
+SCHEDULER = Scheduler()
+
+
+def schedule(delay, args, text=None):
+    SCHEDULER.schedule(delay, args, text)
+
+
+def start(write):
+    SCHEDULER.start(write)
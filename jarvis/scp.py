@@ -12,7 +12,7 @@ import jinja2
 import random as rand
 import re
 
-from . import core, ext, parser, lex, stats, tools, utils
+from . import core, ext, jobs, parser, lex, stats, tools, utils
 
 ###############################################################################
 # Internal Methods
@@ -203,8 +203,16 @@ def author(inp, author):
 @core.alias('ad')
 @guess_author
 def authordetails(inp, author):
-    """Generate detailed statistics about the author."""
-    return lex.author.details(url=stats.update_user(author))
+    """
+    Show the link to the author's statistics page.
+
+    The pages are regenerated in the background whenever the author's
+    pages change.
+    """
+    url = stats.get_user_url(author)
+    if not url:
+        return lex.not_found.author
+    return lex.author.details(url=url)
 
 
 ###############################################################################
@@ -272,47 +280,52 @@ def errors(inp):
         yield lex.errors.done
 
 
-@core.command
-@core.require(channel=core.config.irc.sssc)
-@core.cooldown(7200)
-@core.multiline
-def cleantitles(inp):
-    """
-    Remove orphaned scp titles from the series pages.
+def _clean_line(line, orphaned, purge):
+    pattern = r'^\* \[\[\[([^\]]+)\]\]\] - .+$'
+    parsed = re.match(pattern, line)
+    if not parsed:
+        return line
+    name = parsed.group(1)
+    if name.lower() not in orphaned:
+        return line
+    if not purge:
+        return '* [[[{}]]] - [ACCESS DENIED]'.format(name)
 
-    Staff-only command.
-    """
-    yield lex.cleantitles.start
 
+@jobs.handler('clean_titles')
+def _clean_titles(orphaned):
+    wiki = core.pyscp.wikidot.Wiki('scp-wiki')
+    wiki.auth(core.config.wiki.name, core.config.wiki.password)
     pages = [
         'scp-series', 'scp-series-2', 'scp-series-3', 'scp-series-4',
         'joke-scps', 'scp-ex', 'archived-scps']
-    wiki = core.pyscp.wikidot.Wiki('scp-wiki')
-    wiki.auth(core.config.wiki.name, core.config.wiki.password)
-    orphaned = [p.url.split('/')[-1] for p in errors_orphaned()]
+    orphaned = set(orphaned)
 
-    def clean_line(line, purge):
-        pattern = r'^\* \[\[\[([^\]]+)\]\]\] - .+$'
-        parsed = re.match(pattern, line)
-        if not parsed:
-            return line
-        name = parsed.group(1)
-        if name.lower() not in orphaned:
-            return line
-        if not purge:
-            return '* [[[{}]]] - [ACCESS DENIED]'.format(name)
-
-    for page in map(wiki, pages):
-        source = page.source.split('\n')
+    def clean(name):
+        page = wiki(name)
         purge = 'scp-series' not in page.url
-        source = [clean_line(i, purge) for i in source]
-        source = [i for i in source if i is not None]
-        source = '\n'.join(source)
+        source = [_clean_line(i, orphaned, purge)
+                  for i in page.source.split('\n')]
+        source = '\n'.join(i for i in source if i is not None)
         if source != page.source:
             page.edit(source, comment='clean titles')
 
-    core.wiki.titles.cache_clear()
-    yield lex.cleantitles.end
+    steps = [functools.partial(clean, i) for i in pages]
+    steps.append(core.wiki.titles.cache_clear)
+    return steps
+
+
+@core.command
+@core.require(channel=core.config.irc.sssc)
+@core.cooldown(7200)
+def cleantitles(inp):
+    """
+    Remove orphaned scp titles from the series pages.
+
+    The series pages are edited in the background. Staff-only command.
+    """
+    orphaned = [p.url.split('/')[-1] for p in errors_orphaned()]
+    return jobs.submit('clean_titles', inp, orphaned=orphaned)
 
 
 ###############################################################################
@@ -4,12 +4,12 @@
 # Module Imports
 ###############################################################################
 
+import functools
+import hashlib
+import io
 import pyscp
-import textwrap
 
-from dominate import tags as dt
-
-from . import core, lex, ext
+from . import core, db, ext, jobs
 
 
 ###############################################################################
@@ -58,6 +58,13 @@ google.charts.load('current', {{'packages':['table', 'corechart']}});
 [[/html]]
 """
 
+TOOLTIP = (
+    '<table class="articles_chart_tooltip">'
+    '<tr><td colspan="2">{}</td></tr>'
+    '<tr><td>Rating:</td><td>{}</td></tr>'
+    '<tr><td>Created:</td><td>{}</td></tr>'
+    '</table>')
+
 ###############################################################################
 # Helper Functions
 ###############################################################################
@@ -72,6 +79,13 @@ def html(tag, text, **kwargs):
     return '<{tag}{attrs}>{text}</{tag}>'.format(
         tag=tag, text=text, attrs=attrs)
 
+
+def escape(value):
+    """Escape the value the same way dominate escapes text nodes."""
+    return (
+        str(value).replace('&', '&amp;').replace('<', '&lt;')
+        .replace('>', '&gt;').replace('"', '&quot;'))
+
 ###############################################################################
 # Chart Classes
 ###############################################################################
@@ -79,18 +93,29 @@ def html(tag, text, **kwargs):
 
 class Chart:
 
-    def format_row(self, row, indent):
-        row = ',\n'.join(map(repr, row))
-        row = textwrap.indent(row, '    ')
-        row = '[\n{}\n]'.format(row)
-        return textwrap.indent(row, ' ' * indent)
+    def write_rows(self, buffer, indent):
+        """
+        Write the data rows into the buffer.
+
+        Each row is a bracketed list of the reprs of its values, one per
+        line, with the rows separated by commas.
+        """
+        outer = ' ' * indent
+        inner = ',\n{}    '.format(outer)
+        for idx, row in enumerate(self.data):
+            buffer.write(',\n{}[\n'.format(outer) if idx else outer + '[\n')
+            if row:
+                buffer.write(inner[2:])
+                buffer.write(inner.join(map(repr, row)))
+            buffer.write('\n{}]'.format(outer))
 
     def render(self):
-        data = ',\n'.join([self.format_row(r, 8) for r in self.data])
+        buffer = io.StringIO()
+        self.write_rows(buffer, 8)
         return CHART.format(
             name=self.name,
             class_name=self.class_name,
-            data=data,
+            data=buffer.getvalue(),
             options=self.options)
 
 
@@ -159,17 +184,10 @@ class ArticlesChart(Chart):
 
             date = p.metadata[self.user].date[:10] or '-'
 
-            tooltip = dt.table(
-                dt.tr(dt.td(p.title, colspan=2)),
-                dt.tr(dt.td('Rating:'), dt.td(p.rating)),
-                dt.tr(dt.td('Created:'), dt.td(date)),
-                cls='articles_chart_tooltip')
+            tooltip = TOOLTIP.format(
+                escape(p.title), escape(p.rating), escape(date))
 
-            self.data.append([
-                p.title,
-                p.rating,
-                tooltip.render(pretty=False),
-                color])
+            self.data.append([p.title, p.rating, tooltip, color])
 
 
 class ArticlesTable(Chart):
@@ -208,26 +226,75 @@ class ArticlesTable(Chart):
 ###############################################################################
 
 
-def update_user(name):
+@functools.lru_cache()
+def _get_wiki():
     wiki = pyscp.wikidot.Wiki('scp-stats')
     wiki.auth(core.config.wiki.name, core.config.wiki.password)
-    p = wiki('user:' + name.lower())
+    return wiki
+
 
+def render_user(name):
+    """Render the source of the author's stats page."""
     pages = sorted(
         core.pages.related(name),
         key=lambda x: (x.metadata[name].date, x.created))
     pages = ext.PageView(pages)
 
     if not pages.articles:
-        return lex.not_found.author
-    data = USER.format(
+        return None
+    return USER.format(
         summary_table=SummaryTable(pages.primary(name), name).render(),
         articles_chart=ArticlesChart(pages.articles, name).render(),
         articles_table=ArticlesTable(
             [p for p in pages if p.tags], name).render())
 
+
+def update_user(name):
+    """
+    Regenerate the author's stats page. Return its url.
+
+    The page is only uploaded if its source differs from the last upload.
+    Returns None if the author has no articles. If the upload fails, the
+    hash isn't stored, so that the next update tries again.
+    """
+    data = render_user(name)
+    if data is None:
+        return None
+    digest = hashlib.sha1(data.encode('utf-8')).hexdigest()
+    record = db.AuthorPage.find_one(name=name)
+    if record and record.hash == digest:
+        return record.url
+
+    p = _get_wiki()('user:' + name.lower())
+    jobs.LIMITER.wait()
     try:
         p.create(data, title=name, comment='automated update')
-    except RuntimeError:
-        pass
+    except RuntimeError as e:
+        core.log.error('Failed to upload the stats of {}: {}'.format(name, e))
+        return record.url if record else p.url
+    if not record:
+        record = db.AuthorPage(name=name)
+    record.url, record.hash = p.url, digest
+    record.save()
     return p.url
+
+
+def get_user_url(name):
+    """Return the url of the author's stats page, generating it if needed."""
+    record = db.AuthorPage.find_one(name=name)
+    return record.url if record else update_user(name)
+
+
+def update_users(names):
+    """
+    Regenerate the stats pages of the given authors, one after another.
+
+    The uploads are throttled by the shared wiki rate limiter, so running
+    the updates in parallel wouldn't make them finish any sooner.
+    """
+    for name in names:
+        try:
+            update_user(name)
+        except Exception as e:
+            core.log.error(
+                'Failed to update the stats of {}: {}'.format(name, e))
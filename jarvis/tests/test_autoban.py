@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Test jarvis.autoban module."""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import json
+import pathlib
+import threading
+import time
+
+from jarvis import autoban, db, scheduler
+
+
+###############################################################################
+# Join Flood
+###############################################################################
+
+
+def test_host_pattern():
+    assert autoban.host_pattern('10.0.0.7') == '*!*@10.0.0.*'
+    assert autoban.host_pattern('a1.pool.isp.net') == '*!*@*.pool.isp.net'
+
+
+def test_join_tracker_host_burst():
+    tracker = autoban.JoinTracker(window=10, limit=3)
+    assert tracker.add('#test', 'alpha', '10.0.0.1') is None
+    assert tracker.add('#test', 'bravo', '10.0.0.2') is None
+    burst = tracker.add('#test', 'charlie', '10.0.0.3')
+    assert [nick for nick, _ in burst] == ['alpha', 'bravo', 'charlie']
+    assert tracker.add('#test', 'delta', '10.0.0.4') is None
+
+
+def test_join_tracker_unrelated_joins():
+    tracker = autoban.JoinTracker(window=10, limit=3)
+    joins = [('alpha', 'a.b.c'), ('bravo', 'd.e.f'), ('charlie', 'g.h.i')]
+    assert all(tracker.add('#test', *i) is None for i in joins)
+
+
+def test_join_tracker_similar_nicks_only():
+    tracker = autoban.JoinTracker(window=10, limit=3)
+    joins = [('guest1', 'a.b.c'), ('guest2', 'd.e.f'), ('guest3', 'g.h.i')]
+    assert all(tracker.add('#test', *i) is None for i in joins)
+
+
+###############################################################################
+# Mode Packing
+###############################################################################
+
+
+def test_pack_modes():
+    lines = list(scheduler.pack_modes('#test', '+b', list('abcdef')))
+    assert lines == [
+        ['MODE', '#test', '+bbbb', 'a', 'b', 'c', 'd'],
+        ['MODE', '#test', '+bb', 'e', 'f']]
+
+
+def test_merge_due_unbans():
+    actions = [(['MODE', '#test', '-b', i], None) for i in 'abc']
+    actions.append((['PRIVMSG', '#test'], 'hello'))
+    assert list(scheduler._merge(actions)) == [
+        (['PRIVMSG', '#test'], 'hello'),
+        (['MODE', '#test', '-bbb', 'a', 'b', 'c'], None)]
+
+
+###############################################################################
+# Scheduler
+###############################################################################
+
+
+def test_scheduler_resumes_from_table():
+    unban = ['MODE', '#test', '-b', 'resume!*@*']
+    # scheduled by the previous run, which stopped before it was due
+    scheduler.Scheduler().schedule(0, unban)
+
+    written, done = [], threading.Event()
+
+    def write(args, text):
+        written.append((args, text))
+        if args == unban:
+            done.set()
+
+    scheduler.Scheduler().start(write)
+    assert done.wait(10)
+    assert (unban, None) in written
+    for _ in range(100):
+        if not db.Action.find(args=json.dumps(unban)).exists():
+            break
+        time.sleep(0.05)
+    else:
+        raise AssertionError('the action was not removed')
+
+
+###############################################################################
+# Ban List
+###############################################################################
+
+
+def test_ban_cache_round_trip(tmpdir, monkeypatch):
+    monkeypatch.setattr(
+        autoban, 'CACHE', pathlib.Path(str(tmpdir)) / 'bans.json')
+    ban = autoban.Ban(
+        ['raider'], [autoban.glob_to_regex('*.isp.net')],
+        'Permanent', 'spam', '', None)
+    autoban.save_cache({'#site19': [ban]})
+    banlist = autoban.compile_bans(autoban.load_cache())['#site19']
+    assert banlist.match('someone', 'a.isp.net') == ban
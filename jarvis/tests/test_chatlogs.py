@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""Test jarvis.chatlogs module."""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import io
+
+from jarvis import chatlogs
+
+###############################################################################
+# Parsers
+###############################################################################
+
+RECORDS = [
+    (1462096800, 'alpha', 'hello there'),
+    (1462096861, 'bravo', 'hi alpha'),
+    (1462183200, 'alpha', 'the next day')]
+
+
+def test_parse_weechat():
+    lines = [
+        '2016-05-01 10:00:00\t@Alpha\thello there\n',
+        '2016-05-01 10:00:30\t-->\tBravo (~b@host) has joined #test\n',
+        '2016-05-01 10:01:01\tbravo\thi alpha\n']
+    assert list(chatlogs.parse_weechat(lines)) == [
+        (1462096800, 'Alpha', 'hello there'),
+        (1462096861, 'bravo', 'hi alpha')]
+
+
+def test_parse_irssi():
+    lines = [
+        '--- Log opened Sun May 01 09:00:00 2016\n',
+        '10:00 <+alpha> hello there\n',
+        '10:00 -!- bravo [b@host] has joined #test\n',
+        '--- Day changed Mon May 02 2016\n',
+        '10:00:00 <alpha> the next day\n']
+    assert list(chatlogs.parse_irssi(lines)) == [
+        (1462096800, 'alpha', 'hello there'),
+        (1462183200, 'alpha', 'the next day')]
+
+
+def test_parse_irssi_without_date():
+    assert list(chatlogs.parse_irssi(['10:00 <alpha> hello\n'])) == []
+
+
+def test_parse_znc():
+    lines = [
+        '[10:00:00] <alpha> hello there\n',
+        '[10:00:30] *** Joins: bravo (b@host)\n',
+        '[10:01:01] <@bravo> hi alpha\n']
+    assert list(chatlogs.parse_znc(lines, name='#test_20160501.log')) == [
+        (1462096800, 'alpha', 'hello there'),
+        (1462096861, 'bravo', 'hi alpha')]
+
+
+def test_parse_offset(tmpdir):
+    path = tmpdir.join('test.weechat')
+    path.write('2016-05-01 12:00:00\tAlpha\thello there\n')
+    assert list(chatlogs.parse([str(path)], 'weechat', offset=2)) == [
+        (1462096800, 'alpha', 'hello there')]
+
+
+###############################################################################
+# Round Trips
+###############################################################################
+
+
+def _round_trip(fmt):
+    file = io.StringIO()
+    for line in chatlogs.WRITERS[fmt](RECORDS):
+        file.write(line)
+    return list(chatlogs.PARSERS[fmt](io.StringIO(file.getvalue())))
+
+
+def test_round_trip_weechat():
+    assert _round_trip('weechat') == RECORDS
+
+
+def test_round_trip_irssi():
+    assert _round_trip('irssi') == RECORDS
+
+
+def test_import_export(tmpdir):
+    path = tmpdir.join('test.weechat')
+    path.write(''.join(chatlogs.WRITERS['weechat'](RECORDS)))
+    records = chatlogs.parse([str(path)], 'weechat')
+    progress = list(chatlogs.import_logs(records, '#chatlogs', batch=2))
+    assert [count for count, _ in progress] == [2, 3]
+
+    file = io.StringIO()
+    assert chatlogs.export_logs(file, '#chatlogs') == 3
+    assert file.getvalue() == path.read()
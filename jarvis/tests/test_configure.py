@@ -63,3 +63,8 @@ def test_configure_urbandict():
 def test_configure_gibber():
     assert run('.conf gibber off') == lex.configure.gibber.false
     assert run('.gib') == lex.gibber.denied
+
+
+def test_configure_retention():
+    assert run('.conf retention 30') == lex.configure.retention(days=30)
+    assert run('.conf retention off') == lex.configure.retention(days=0)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""Test jarvis.db module."""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import arrow
+import importlib.util
+import pathlib
+import peewee
+import pytest
+import sqlite3
+import threading
+
+from jarvis import db
+
+###############################################################################
+# Connection Management
+###############################################################################
+
+
+@pytest.fixture
+def scratch(tmpdir):
+    """Point the database at a scratch file for the duration of the test."""
+    session, nick = db.db.database, db.NICK
+    path = str(tmpdir.join('scratch.db'))
+    yield path
+    db.init(session, nick=nick)
+
+
+def pragma(name):
+    return db.db.execute_sql('PRAGMA {}'.format(name)).fetchone()[0]
+
+
+def test_pragmas(scratch):
+    db.init(scratch, pragmas={'cache_size': -1234}, timeout=2)
+    assert pragma('cache_size') == -1234
+    assert pragma('synchronous') == 1
+    assert pragma('temp_store') == 2
+    assert pragma('busy_timeout') == 2000
+    assert pragma('journal_mode') == 'wal'
+
+
+def test_readonly_rejects_writes(scratch):
+    db.init(scratch)
+
+    @db.readonly
+    def write():
+        db.Memo.create(user='alpha', channel='#test', text='memo')
+
+    with pytest.raises(peewee.OperationalError):
+        write()
+    assert not db.Memo.select().exists()
+
+
+def test_retry_when_locked(scratch):
+    db.init(scratch, timeout=0.01)
+    conn = sqlite3.connect(
+        scratch, isolation_level=None, check_same_thread=False)
+    conn.execute('BEGIN EXCLUSIVE')
+    timer = threading.Timer(0.1, conn.execute, ('COMMIT',))
+    timer.start()
+    try:
+        db.Memo.create(user='alpha', channel='#test', text='memo')
+    finally:
+        timer.join()
+        conn.close()
+    assert db.Memo.find_one(user='alpha').text == 'memo'
+
+
+###############################################################################
+# Time Ranges
+###############################################################################
+
+
+def test_between_boundaries(scratch):
+    db.init(scratch)
+    for time in (3600, 7200, 10800):
+        db.Alert.create(user='alpha', time=time, text=str(time))
+
+    def between(start=None, end=None):
+        query = db.Alert.between(db.Alert.select(), start, end)
+        return [i.time for i in query.order_by(db.Alert.time)]
+
+    # the start is inclusive and the end is exclusive
+    assert between(3600, 10800) == [3600, 7200]
+    assert between(3601, 10801) == [7200, 10800]
+    assert between(7200, 7200) == []
+    assert between(start=7200) == [7200, 10800]
+    assert between(end=7200) == [3600]
+    assert between(arrow.get(3600), '1970-01-01 03:00:00') == [3600, 7200]
+    assert db.Alert.to_arrow(between(end=7200)[0]) == arrow.get(3600)
+
+
+###############################################################################
+# Migrations
+###############################################################################
+
+# the quote table as created by the versions before the schema migrations
+BASELINE_QUOTES = (
+    'CREATE TABLE "quote" ('
+    '"id" INTEGER NOT NULL PRIMARY KEY, '
+    '"user" VARCHAR(255) NOT NULL, '
+    '"channel" VARCHAR(255) NOT NULL, '
+    '"time" DATETIME NOT NULL, '
+    '"text" TEXT NOT NULL)')
+
+
+def test_migrate_baseline_quote_times(tmpdir):
+    path = str(tmpdir.join('baseline.db'))
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_QUOTES)
+    conn.executemany(
+        'INSERT INTO quote (user, channel, time, text) VALUES (?, ?, ?, ?)', [
+            ('alpha', '#test', '2016-03-01', 'third'),
+            ('bravo', '#test', '2016-01-01', 'first'),
+            ('alpha', '#test', '2016-02-01 12:00:00', 'second')])
+    conn.commit()
+    conn.close()
+
+    session, nick = db.db.database, db.NICK
+    try:
+        db.init(path)
+        quotes = list(db.Quote.select().order_by(db.Quote.channel_ordinal))
+        assert [i.text for i in quotes] == ['first', 'second', 'third']
+        assert [i.ordinal for i in quotes] == [1, 1, 2]
+        assert quotes[0].time == arrow.get('2016-01-01').timestamp
+    finally:
+        db.init(session, nick=nick)
+
+
+# tells and alerts as created by the same versions
+BASELINE_TELLS = (
+    'CREATE TABLE "tell" ('
+    '"id" INTEGER NOT NULL PRIMARY KEY, '
+    '"sender" VARCHAR(255) NOT NULL, '
+    '"recipient" VARCHAR(255) NOT NULL, '
+    '"topic" VARCHAR(255), '
+    '"text" TEXT NOT NULL, '
+    '"time" DATETIME NOT NULL)')
+
+BASELINE_ALERTS = (
+    'CREATE TABLE "alert" ('
+    '"id" INTEGER NOT NULL PRIMARY KEY, '
+    '"user" VARCHAR(255) NOT NULL, '
+    '"time" DATETIME NOT NULL, '
+    '"text" TEXT NOT NULL)')
+
+
+def test_migrate_baseline_tell_alert_times(tmpdir):
+    path = str(tmpdir.join('baseline.db'))
+    conn = sqlite3.connect(path)
+    conn.execute(BASELINE_TELLS)
+    conn.execute(BASELINE_ALERTS)
+    conn.executemany(
+        'INSERT INTO tell (sender, recipient, text, time) '
+        'VALUES (?, ?, ?, ?)', [
+            ('alpha', 'bravo', 'text', '2016-01-01 12:00:00.123456'),
+            ('alpha', 'bravo', 'epoch', 1451649600)])
+    conn.executemany(
+        'INSERT INTO alert (user, time, text) VALUES (?, ?, ?)', [
+            ('alpha', '2016-01-01 12:00:00', 'text'),
+            ('alpha', 1451649600, 'epoch')])
+    conn.commit()
+    conn.close()
+
+    session, nick = db.db.database, db.NICK
+    try:
+        db.init(path)
+        for model in (db.Tell, db.Alert):
+            assert [i.time for i in model.select()] == [1451649600] * 2
+            assert db.db.execute_sql(
+                'SELECT DISTINCT typeof(time) FROM {}'.format(
+                    model._meta.db_table)).fetchall() == [('integer',)]
+        alerts = db.Alert.between(
+            db.Alert.select(), '2016-01-01', '2016-01-02')
+        assert [i.text for i in alerts] == ['text', 'epoch']
+    finally:
+        db.init(session, nick=nick)
+
+
+###############################################################################
+# Activity Rollups
+###############################################################################
+
+
+def test_activity_rebuild_skips_own_lines(tmpdir):
+    session, nick = db.db.database, db.NICK
+    try:
+        db.init(str(tmpdir.join('activity.db')), nick='jarvis')
+        for user in ('alpha', 'jarvis', 'alpha'):
+            db.Message.create(
+                user=user, channel='#test', time=7200, text='text')
+        db.Activity.rebuild()
+        talkers = {i.user: i.count for i in db.Talker.select()}
+        assert talkers == {'alpha': 2}
+        assert [i.count for i in db.Activity.select()] == [2]
+    finally:
+        db.init(session, nick=nick)
+
+
+###############################################################################
+# Log Archive
+###############################################################################
+
+
+def test_archive_compressed_text_searchable(tmpdir):
+    session, nick = db.db.database, db.NICK
+    try:
+        db.init(str(tmpdir.join('archive.db')))
+        db.Message.create(
+            user='alpha', channel='#test', time=3600, text='Hello World')
+        assert db.archive_messages('#test', 7200, compress=True) == 1
+        found = [i for q in db.find_messages(text_lower='hello world')
+                 for i in q]
+        assert [i.text for i in found] == ['Hello World']
+        table = db.archives()[0]._meta.db_table
+        assert db.logdb.execute_sql(
+            'SELECT user FROM "{}" WHERE unarchive(text) LIKE ?'.format(table),
+            ('%world%',)).fetchall() == [('alpha',)]
+    finally:
+        db.init(session, nick=nick)
+
+
+###############################################################################
+# Log Database Split
+###############################################################################
+
+
+def load_script(name):
+    path = pathlib.Path(__file__).parents[2] / 'scripts' / (name + '.py')
+    spec = importlib.util.spec_from_file_location(name, str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def tables(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {i[0] for i in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        conn.close()
+
+
+def test_split_logs(tmpdir):
+    main, logs = str(tmpdir.join('main.db')), str(tmpdir.join('logs.db'))
+    session, nick = db.db.database, db.NICK
+    try:
+        db.init(main)
+        for stamp, user in ((3600, 'alpha'), (7200, 'alpha'), (10800, 'beta')):
+            db.Message.create(
+                user=user, channel='#test', time=stamp, text='text')
+            db.Activity.record('#test', user, stamp)
+        db.archive_messages('#test', 7200, compress=True)
+        db.db.close()
+        db.logdb.close()
+
+        load_script('split_logs').split(main, logs)
+        left = tables(main)
+        assert not left & {'message', 'activity', 'talker'}
+        assert not any(i.startswith(db.ARCHIVE_PREFIX) for i in left)
+
+        db.init(main, logs=logs)
+        assert db.Message.select().count() == 2
+        assert [i.text for q in db.find_messages(user='alpha') for i in q] \
+            == ['text', 'text']
+        talkers = {i.user: i.count for i in db.Talker.select()}
+        assert talkers == {'alpha': 2, 'beta': 1}
+    finally:
+        db.init(session, nick=nick)
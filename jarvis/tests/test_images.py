@@ -5,8 +5,11 @@
 # Module Imports
 ###############################################################################
 
+import pytest
+import time
+import types
 
-from jarvis import lex, images
+from jarvis import core, db, lex, images, utils
 from jarvis.tests.utils import run
 
 
@@ -26,3 +29,112 @@ def test_images_search():
 
 def test_images_stats_simple():
     assert run('.im stats 002-099') == lex.images.stats
+
+
+def test_images_update_keeps_order():
+    registry = images.ImageRegistry()
+    for name in 'abc':
+        registry.add(images.Image(
+            'http://x/{}.jpg'.format(name), 'http://x/page', 'category'))
+    first = registry.by_page('page')[0]
+    registry.update(first, status='BY-SA CC')
+    registry.update(first, url='http://x/d.jpg')
+    assert registry.by_page('page')[0] is first
+    assert registry.by_category('category')[0] is first
+    assert registry.by_url('http://x/d.jpg') is first
+    assert not registry.by_url('http://x/a.jpg')
+
+
+def test_images_failed_flush_rescheduled(monkeypatch):
+    class Page:
+        def create(self, *args, **kwargs):
+            raise RuntimeError('try again later')
+
+    monkeypatch.setattr(images, 'render_images', lambda category: 'source')
+    monkeypatch.setattr(images, 'wiki', lambda name: Page())
+    monkeypatch.setattr(images, 'SAVE_DELAY', 3600)
+    writer = images._Writer()
+    images.DIRTY['flushtest'] = [('edit', 'user')]
+    try:
+        with pytest.raises(RuntimeError):
+            writer.flush()
+        assert images.DIRTY['flushtest'] == [('edit', 'user')]
+        assert writer.timer.is_alive()
+    finally:
+        if writer.timer:
+            writer.timer.cancel()
+        images.DIRTY.pop('flushtest', None)
+
+
+def test_images_flush_keeps_wiki_edits(monkeypatch):
+    class Page:
+        revisions = [types.SimpleNamespace(number=2)]
+
+        def create(self, *args, **kwargs):
+            raise AssertionError('the wiki edit was overwritten')
+
+    monkeypatch.setattr(images, 'render_images', lambda category: 'source')
+    monkeypatch.setattr(images, 'wiki', lambda name: Page())
+    db.ImageCategory.create(name='conflicttest', revision=1)
+    images.DIRTY['conflicttest'] = [('edit', 'user')]
+    try:
+        assert images._Writer().flush() == 0
+        assert images.CONFLICTS['conflicttest'] == [('edit', 'user')]
+    finally:
+        images.CONFLICTS.pop('conflicttest', None)
+        images.DIRTY.pop('conflicttest', None)
+        db.ImageCategory.purge(name='conflicttest')
+
+
+def test_images_unsaved_changes_survive_restart(monkeypatch):
+    monkeypatch.setattr(images, 'SAVE_DELAY', 3600)
+    db.ImageCategory.create(name='restarttest', hash='saved before edit')
+    db.ImageRecord.create(
+        url='http://x/restart.jpg', page='http://x/restart',
+        category='restarttest')
+    try:
+        images.load_images()
+        assert images.HASHES['restarttest'] == 'saved before edit'
+        assert 'restarttest' in images.DIRTY
+    finally:
+        if images.WRITER.timer:
+            images.WRITER.timer.cancel()
+        images.DIRTY.pop('restarttest', None)
+        images.HASHES.pop('restarttest', None)
+        images.IMAGES.remove(images.IMAGES.by_category('restarttest'))
+        db.ImageRecord.purge(category='restarttest')
+        db.ImageCategory.purge(name='restarttest')
+
+
+def test_images_scan_skips_failed_pages(monkeypatch):
+    def scan_page(name):
+        if name == 'broken':
+            raise RuntimeError('page not found')
+        return name, 'http://x/' + name, None, []
+
+    monkeypatch.setattr(images, '_scan_page', scan_page)
+    result = run(
+        '.im scan first broken second', _channel=core.config.irc.imageteam)
+    assert len(result) == 4
+    assert lex.images.scan.failed(page='broken') in result
+    assert lex.images.scan.unknown_category(page='first') in result
+    assert lex.images.scan.unknown_category(page='second') in result
+    assert result[-1] == lex.images.scan.done(count=0)
+
+
+def test_images_scan_rate_limited(monkeypatch):
+    calls = []
+    limiter = utils.RateLimiter(0.05)
+
+    def scan_page(name):
+        limiter.wait()
+        calls.append(time.monotonic())
+        return name, 'http://x/' + name, 'cat', []
+
+    monkeypatch.setattr(images, '_scan_page', scan_page)
+    monkeypatch.setattr(images, 'SCAN_WORKERS', 4)
+    results = list(images._scan_pages(['p{}'.format(i) for i in range(6)]))
+    assert sorted(i[0] for i in results) == ['p{}'.format(i) for i in range(6)]
+    assert not any(i[2] for i in results)
+    calls.sort()
+    assert all(b - a >= 0.04 for a, b in zip(calls, calls[1:]))
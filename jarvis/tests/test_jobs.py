@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Test jarvis.jobs module."""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import arrow
+import functools
+import pytest
+import types
+
+from jarvis import db, jobs, lex
+from jarvis.tests.utils import run
+
+
+###############################################################################
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """Job queue which only runs the jobs when told to."""
+    notes = []
+    monkeypatch.setattr(jobs.LIMITER, 'wait', lambda: None)
+    monkeypatch.setattr(
+        jobs, 'NOTIFY', lambda channel, text: notes.append(text))
+    queue = jobs.JobQueue()
+    monkeypatch.setattr(queue, 'start', lambda: None)
+    queue.notes = notes
+    return queue
+
+
+def submit(queue, kind, **kwargs):
+    inp = types.SimpleNamespace(user='test-user', channel='#test-channel')
+    return queue.submit(kind, inp, **kwargs)
+
+
+def reload(job):
+    return db.Job.get(db.Job.id == job.id)
+
+
+###############################################################################
+# Queue
+###############################################################################
+
+
+def test_jobs_submit(queue):
+    job = reload(submit(queue, 'test', count=3))
+    assert job.status == 'pending'
+    assert job.step == 0
+    assert job.user == 'test-user'
+
+
+def test_jobs_resume_from_table(queue, monkeypatch):
+    calls = []
+    monkeypatch.setitem(jobs.HANDLERS, 'test', lambda count: [
+        functools.partial(calls.append, i) for i in range(count)])
+    job = submit(queue, 'test', count=3)
+    # the bot was restarted after the first step
+    db.Job.update(step=1).where(db.Job.id == job.id).execute()
+
+    jobs.JobQueue()._run(reload(job))
+    assert calls == [1, 2]
+    job = reload(job)
+    assert job.status == 'done'
+    assert job.step == job.steps == 3
+    assert queue.notes
+
+
+def test_jobs_retry_backoff(queue, monkeypatch):
+    def fail():
+        raise RuntimeError('wiki is down')
+
+    monkeypatch.setitem(jobs.HANDLERS, 'test', lambda: [fail])
+    monkeypatch.setattr(jobs, 'RETRY_DELAY', 100)
+    monkeypatch.setattr(jobs, 'MAX_ATTEMPTS', 3)
+    job = submit(queue, 'test')
+
+    for attempt, delay in ((1, 100), (2, 200)):
+        now = arrow.utcnow().timestamp
+        queue._run(reload(job))
+        failed = reload(job)
+        assert failed.attempts == attempt
+        assert failed.error == 'wiki is down'
+        assert failed.status != 'failed'
+        assert delay <= failed.retry - now <= delay + 5
+    assert not queue.notes
+
+    queue._run(reload(job))
+    assert reload(job).status == 'failed'
+    assert queue.notes
+
+
+###############################################################################
+# Commands
+###############################################################################
+
+
+def test_jobs_status(queue):
+    job = submit(queue, 'test')
+    assert run('!jobs', job.id) == lex.jobs.status(id=job.id, kind='test')
+
+
+def test_jobs_not_found():
+    assert run('!jobs 999999') == lex.jobs.not_found
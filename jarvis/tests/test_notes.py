@@ -4,9 +4,10 @@
 ###############################################################################
 # Module Imports
 ###############################################################################
+import pathlib
+import threading
 
-
-from jarvis import core, lex
+from jarvis import core, db, lex, markov, notes
 from jarvis.tests.utils import run
 
 
@@ -163,6 +164,40 @@ def test_seen_total():
 def test_seen_never():
     assert run('.seen -') == lex.seen.never
 
+
+def test_seen_across_archives(tmpdir):
+    session, nick = db.db.database, db.NICK
+    try:
+        db.init(str(tmpdir.join('seen.db')))
+        db.Message.create(
+            user='alpha', channel='#test-channel', time=7200,
+            text='archived')
+        db.archive_messages('#test-channel', 10800)
+        # imported into the live table after the newer logs were archived
+        db.Message.create(
+            user='alpha', channel='#test-channel', time=3600,
+            text='imported')
+        assert run('.seen alpha -f') == lex.seen.first(
+            user='alpha', text='imported')
+        assert run('.seen alpha') == lex.seen.last(
+            user='alpha', text='archived')
+    finally:
+        db.init(session, nick=nick)
+
+
+###############################################################################
+# Activity
+###############################################################################
+
+
+def test_activity():
+    run('1', _user='user5')
+    assert run('.activity') == lex.activity.summary(days=30)
+
+
+def test_activity_bad_days():
+    assert run('.activity -d 0') == lex.activity.bad_days
+
 ###############################################################################
 # Quote
 ###############################################################################
@@ -236,6 +271,22 @@ def test_quote_get_cross_channel():
         '.q #chan2', _channels=['#chan2']) == lex.quote.get(text='quote8')
 
 
+def test_quote_delete_renumbers():
+    run('.q add deltest first')
+    run('.q add deltest second')
+    run('.q add deltest third')
+    assert run('.q del deltest 1') == lex.quote.deleted(text='first')
+    assert run('.q deltest 1') == lex.quote.get(text='second', total=2)
+    assert run('.q deltest 2') == lex.quote.get(text='third', total=2)
+
+
+def test_quote_add_backdated():
+    run('.q add ordtest later')
+    run('.q add 2001-01-01 ordtest earlier')
+    assert run('.q ordtest 1') == lex.quote.get(text='earlier', total=2)
+    assert run('.q ordtest 2') == lex.quote.get(text='later', total=2)
+
+
 ###############################################################################
 # Memos
 ###############################################################################
@@ -301,6 +352,52 @@ def test_memo_count():
     assert run('.memo count') == lex.memo.count
 
 
+def test_memo_cache_evicts_least_recently_used():
+    for channel, users in (
+            ('#memolru1', 'ab'), ('#memolru2', 'cd'), ('#memolru3', 'ef')):
+        for user in users:
+            db.Memo.create(user=user, channel=channel, text='memo')
+    cache = notes.MemoCache(4)
+    cache.get('#memolru1', 'a')
+    cache.get('#memolru2', 'c')
+    cache.get('#memolru1', 'b')
+    cache.get('#memolru3', 'e')
+    assert list(cache.channels) == ['#memolru1', '#memolru3']
+
+
+def test_memo_cache_no_queries_after_warmup(monkeypatch):
+    db.Memo.create(user='alpha', channel='#memowarm', text='memo')
+    cache = notes.MemoCache(100)
+    assert cache.get('#memowarm', 'alpha') == 'memo'
+
+    def find(**rules):
+        raise AssertionError('the memos were read from the database')
+
+    monkeypatch.setattr(db.Memo, 'find', find)
+    assert cache.get('#memowarm', 'alpha') == 'memo'
+    assert cache.get('#memowarm', 'beta') is None
+    assert cache.count('#memowarm') == 1
+
+
+def test_memo_cache_write_through():
+    cache = notes.MemoCache(100)
+    cache.add('#memowrite', 'alpha', 'one')
+    cache.update('#memowrite', 'alpha', 'one two')
+    assert cache.get('#memowrite', 'alpha') == 'one two'
+    assert notes.MemoCache(100).get('#memowrite', 'alpha') == 'one two'
+    cache.delete('#memowrite', 'alpha')
+    assert cache.get('#memowrite', 'alpha') is None
+    assert notes.MemoCache(100).get('#memowrite', 'alpha') is None
+
+
+def test_memo_commands_update_cache():
+    run('.memo add cacheuser first')
+    run('.memo append cacheuser second')
+    assert notes.MEMOS.get('#test-channel', 'cacheuser') == 'first second'
+    run('.memo del cacheuser')
+    assert notes.MEMOS.get('#test-channel', 'cacheuser') is None
+
+
 ###############################################################################
 # Memos
 ###############################################################################
@@ -331,3 +428,76 @@ def test_alert_echo_multiple():
     assert run('.al echo') == [
         lex.alert.echo, lex.alert.echo, lex.alert.echo, lex.alert.echo,
         lex.alert.more(count=3)]
+
+
+###############################################################################
+# Gibber
+###############################################################################
+
+
+def test_gibber_chain_incremental():
+    chain = markov.Chain()
+    chain.add('one two three')
+    chain.add('one two four')
+    assert chain.make_short_sentence(400) in ['one two three', 'one two four']
+
+
+def test_gibber_chain_no_verbatim_copies():
+    chain = markov.Chain()
+    chain.add('just a single line')
+    assert chain.make_short_sentence(400) is None
+
+
+def test_gibber_chain_persistence():
+    chain = markov.Chain()
+    chain.add('one two three')
+    assert markov.Chain.load(chain.dump()).model == chain.model
+
+
+def test_gibber_chain_walk_while_adding():
+    chain = markov.Chain()
+    chain.add('a0 b0 c0')
+    chain.add('a0 b0 d0')
+    stop = threading.Event()
+
+    def add():
+        idx = 0
+        while not stop.is_set():
+            idx += 1
+            chain.add('a0 b0 c{0} d{0} e{0}'.format(idx))
+
+    thread = threading.Thread(target=add)
+    thread.start()
+    try:
+        for _ in range(500):
+            chain.make_short_sentence(400)
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_gibber_cache_keeps_lines_logged_during_build(tmpdir, monkeypatch):
+    monkeypatch.setattr(markov, 'MODELDIR', pathlib.Path(str(tmpdir)))
+    cache = markov.ChainCache(10 ** 6)
+
+    def bootstrap(channel, user):
+        cache.update(channel, 'alpha', 'logged during the build')
+        chain = markov.Chain()
+        chain.add('already in the logs')
+        return chain
+
+    monkeypatch.setattr(markov, '_bootstrap', bootstrap)
+    model = cache.get('#test', None).model
+    assert ('already', 'in') in model
+    assert ('logged', 'during') in model
+
+
+def test_gibber_cache_replays_journal(tmpdir, monkeypatch):
+    monkeypatch.setattr(markov, 'MODELDIR', pathlib.Path(str(tmpdir)))
+    monkeypatch.setattr(markov, '_bootstrap', lambda *_: markov.Chain())
+    markov.ChainCache(10 ** 6).get('#test', None)
+    markov.ChainCache(10 ** 6).update('#test', 'alpha', 'one two three')
+    cache = markov.ChainCache(10 ** 6)
+    assert ('one', 'two') in cache.get('#test', None).model
+    assert ('one', 'two') in markov.ChainCache(10 ** 6).get(
+        '#test', None).model
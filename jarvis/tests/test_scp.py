@@ -4,7 +4,7 @@
 # Module Imports
 ###############################################################################
 
-from jarvis import scp, lex
+from jarvis import db, jobs, scp, stats, lex
 from jarvis.tests.utils import run, page
 
 ###############################################################################
@@ -45,6 +45,25 @@ def test_authordetails_showmore():
     assert run('.sm 3')
 
 
+def test_authordetails_failed_upload_not_stored(monkeypatch):
+    class Page:
+        url = 'http://scp-stats.wikidot.com/user:uploadtest'
+        error = RuntimeError('try again later')
+
+        def create(self, *args, **kwargs):
+            if self.error:
+                raise self.error
+
+    monkeypatch.setattr(stats, 'render_user', lambda name: 'source')
+    monkeypatch.setattr(stats, '_get_wiki', lambda: lambda name: Page())
+    monkeypatch.setattr(jobs.LIMITER, 'wait', lambda: None)
+    assert stats.update_user('uploadtest') == Page.url
+    assert not db.AuthorPage.find_one(name='uploadtest')
+    Page.error = None
+    assert stats.update_user('uploadtest') == Page.url
+    assert db.AuthorPage.find_one(name='uploadtest').hash
+
+
 ###############################################################################
 # Misc
 ###############################################################################
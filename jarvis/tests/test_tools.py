@@ -7,7 +7,7 @@
 
 import uuid
 
-from jarvis import tools, lex, core
+from jarvis import tools, lex, core, db
 from jarvis.tests.utils import run
 
 
@@ -74,6 +74,98 @@ def test_dice_tail_garbage():
     assert run('.roll 5d5d5') == tools.dice._parser.usage('dice')
 
 
+def test_dice_keep_highest():
+    assert run('.dice 4d6kh3') == lex.dice.output.simple
+
+
+def test_dice_exploding():
+    assert run('.dice 3d6! -2d4!') == lex.dice.output.simple
+
+
+def test_dice_exploding_fudge():
+    assert run('.dice 5df!') == tools.dice._parser.usage('dice')
+    assert not tools.Throw.PATTERN.match('5df!')
+
+
+def test_dice_large_expanded():
+    assert run('.dice 90000d20 -e') == lex.dice.output.expanded
+
+
+def _rolls(text, times, expand=False):
+    throw = tools.Throw.parse(text)
+    return [throw.roll(expand)[0] for _ in range(times)]
+
+
+def _mean(values):
+    return sum(values) / len(values)
+
+
+def _stdev(values):
+    mean = _mean(values)
+    return (sum((i - mean) ** 2 for i in values) / len(values)) ** 0.5
+
+
+def test_throw_parse():
+    assert tools.Throw.parse('-4d6!kl2') == (-1, 4, 6, True, (False, 2))
+    assert tools.Throw.parse('df') == (1, 1, 'f', False, None)
+
+
+def test_throw_exact_distribution():
+    rolls = _rolls('10d6', 4000)
+    assert min(rolls) >= 10 and max(rolls) <= 60
+    assert abs(_mean(rolls) - 35) < 0.6
+    assert abs(_stdev(rolls) - (10 * 35 / 12) ** 0.5) < 0.5
+
+
+def test_throw_approximate_distribution():
+    rolls = _rolls('10000d6', 1000)
+    assert abs(_mean(rolls) - 35000) < 35
+    assert abs(_stdev(rolls) - (10000 * 35 / 12) ** 0.5) < 20
+
+
+def test_throw_negative():
+    assert all(-20 <= i <= -2 for i in _rolls('-2d10', 100))
+
+
+def test_throw_fudge():
+    rolls = _rolls('100df', 500)
+    assert all(-100 <= i <= 100 for i in rolls)
+    assert abs(_mean(rolls)) < 1.5
+
+
+def test_throw_keep_highest():
+    # the expected sum of the three highest of four d6 is 15869 / 1296
+    rolls = _rolls('4d6kh3', 4000)
+    assert min(rolls) >= 3 and max(rolls) <= 18
+    assert abs(_mean(rolls) - 15869 / 1296) < 0.2
+
+
+def test_throw_keep_lowest():
+    assert set(_rolls('2d2kl1', 100)) <= {1, 2}
+    # the expected lowest of two d20 is 2870 / 400
+    assert abs(_mean(_rolls('2d20kl1', 2000)) - 2870 / 400) < 0.5
+
+
+def test_throw_exploding():
+    # an exploding d6 is worth 3.5 * 6 / 5 on average
+    rolls = _rolls('20d6!', 4000)
+    assert min(rolls) >= 20
+    assert abs(_mean(rolls) - 84) < 1
+
+
+def test_throw_exploding_approximation():
+    # an exploding d4 is worth 2.5 * 4 / 3 on average, both when each die is
+    # rolled and when the sum is drawn from the approximation
+    assert abs(_mean(_rolls('40d4!', 4000)) - 400 / 3) < 1.5
+    assert abs(_mean(_rolls('4000d4!', 400)) - 40000 / 3) < 50
+
+
+def test_throw_faces_only_when_expanded():
+    throw = tools.Throw.parse('50000d10')
+    assert throw.roll()[1] == []
+    assert len(throw.roll(expand=True)[1]) == tools.SHOWN_DICE
+
+
 ###############################################################################
 # Misc
 ###############################################################################
@@ -126,17 +218,73 @@ def test_updatehelp():
 
 
 def test_onpage():
+    # the index is built in the background when the bot connects
+    tools.update_members()
     assert run('.onpage anqxyr -o') == [
-        lex.onpage.working,
         lex.onpage.found(user='anqxyr', page=15)]
+    assert run('.onpage anqxyr') == [lex.onpage.found(user='anqxyr', page=15)]
 
 
-def test_onpage_not_found():
-    # this test should not be run under normal circumstances
-    # as it is extremely time-consuming, requiring retrieval of over 300
-    # pages and taking over 10 minutes to run.
-    return
+def test_update_members_incremental(monkeypatch):
+    members = ['user{}'.format(i) for i in range(25)]
+    fetched = []
+
+    def members_on_page(page):
+        fetched.append(page)
+        total = max((len(members) + 9) // 10, 1)
+        return total, members[(page - 1) * 10:page * 10]
+
+    def index():
+        return [(i.user, i.page, i.position) for i in
+                db.Member.select().order_by(db.Member.position)]
+
+    def expected():
+        return [(user, idx // 10 + 1, idx) for idx, user in enumerate(members)]
+
+    monkeypatch.setattr(tools, '_members_on_page', members_on_page)
+    db.Member.delete().execute()
+    tools.update_members()
+    assert index() == expected()
+
+    # new members only need the last page and the pages after it
+    members.extend(['new1', 'new2', 'new3', 'new4', 'new5', 'new6'])
+    fetched.clear()
+    tools.update_members()
+    assert index() == expected()
+    assert 1 not in fetched
+
+    # pages before the member who left are kept
+    first = [i.id for i in db.Member.find(page=1)]
+    members.remove('user15')
+    tools.update_members()
+    assert index() == expected()
+    assert [i.id for i in db.Member.find(page=1)] == first
+
 
+def test_update_members_bounded(monkeypatch):
+    members = ['user{}'.format(i) for i in range(25)]
+
+    def members_on_page(page):
+        total = max((len(members) + 9) // 10, 1)
+        return total, members[(page - 1) * 10:page * 10]
+
+    monkeypatch.setattr(tools, '_members_on_page', members_on_page)
+    db.Member.delete().execute()
+    tools.update_members()
+    members.extend('new{}'.format(i) for i in range(30))
+    tools.update_members(max_pages=1)
+    assert db.Member.select().count() == 40
+    assert db.Member.find_one(user='new14').page == 4
+
+    # shifted pages are left for the next full update
+    members.remove('user3')
+    tools.update_members(max_pages=1)
+    assert db.Member.select().count() == 40
+    assert db.Member.find_one(user='user4').page == 1
+
+
+def test_onpage_not_found():
+    # only the few newest member list pages are checked
     assert run('.onpage blahblhablah') == [
         lex.onpage.working,
         lex.onpage.not_found]
@@ -173,6 +321,26 @@ def test_convert_rounding_error():
     assert run('.convert 10000 lbs to kg') != lex.convert.result(value=0)
 
 
+def test_convert_repeated():
+    tools._conversion_plan.cache_clear()
+    result = lex.convert.result(value=32.808398950131235)
+    assert run('.convert 10 meter to feet -p') == result
+    # the second conversion reuses the plan and gives the same value
+    assert run('.convert 10 meter to feet -p') == result
+    assert tools._conversion_plan.cache_info().hits == 1
+
+
+def test_convert_repeated_offset_units():
+    result = lex.convert.result(value=212)
+    assert run('.convert 100 degC to degF -p 0') == result
+    assert run('.convert 100 degC to degF -p 0') == result
+
+
+def test_convert_repeated_conversion_error():
+    assert run('.convert 10 meters to rabbits') == lex.convert.conversion_error
+    assert run('.convert 10 meters to rabbits') == lex.convert.conversion_error
+
+
 ###############################################################################
 # Names
 ###############################################################################
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""Test jarvis.wordfilter module."""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+
+from jarvis import wordfilter
+
+
+###############################################################################
+# Automaton
+###############################################################################
+
+
+def test_automaton_overlapping_words():
+    automaton = wordfilter.Automaton(['he', 'she', 'his', 'hers'])
+    assert list(automaton.iter('ushers')) == ['she', 'he', 'hers']
+
+
+def test_automaton_no_match():
+    automaton = wordfilter.Automaton(['he', 'she', 'his', 'hers'])
+    assert automaton.search('xyz') is None
+
+
+###############################################################################
+# Word Filter
+###############################################################################
+
+
+def test_wordfilter_simple():
+    assert wordfilter.WordFilter(['badword']).search('xXbadwordXx')
+
+
+def test_wordfilter_leetspeak():
+    assert wordfilter.WordFilter(['badword']).search('B4DW0RD')
+
+
+def test_wordfilter_separators_split_words():
+    words = wordfilter.WordFilter(['badword'])
+    assert words.search('xx_badword_xx') == 'badword'
+    assert words.search('bad_word') is None
+    assert words.search('b.a.d.w.o.r.d') is None
+
+
+def test_wordfilter_repeats_not_squashed():
+    assert wordfilter.WordFilter(['badword']).search('baaadword') is None
+
+
+def test_wordfilter_clean_text():
+    assert 'goodname' not in wordfilter.WordFilter(['badword'])
+
+
+def test_wordfilter_default_list():
+    words = wordfilter.WordFilter.from_file(
+        wordfilter.WORDLISTS / 'profanity.txt')
+    assert words.search('bantest')
+    assert not words.search('anqxyr')
+
+
+def test_wordfilter_default_list_false_positives():
+    words = wordfilter.WordFilter.from_file(
+        wordfilter.WORDLISTS / 'profanity.txt')
+    nicks = [
+        'Swanky', 'Atwater', 'shiitake', 'Dash_It', 'Ana_Zing', 'Rob_Itch',
+        'Mr.Nazir', 'Matt_Wan_Kenobi', 'Slutsky', 'Scunthorpe']
+    assert [i for i in nicks if words.search(i)] == []
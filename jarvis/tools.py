@@ -6,22 +6,25 @@
 ###############################################################################
 
 import arrow
-import bs4
+import collections
 import faker
 import functools
+import lxml.html
+import math
+import peewee
 import pint
 import random
+import re
+import threading
 import tweepy
 
-from . import core, parser, lex, __version__, utils
+from . import core, db, parser, lex, __version__, utils
 
 ###############################################################################
 # Global Variables
 ###############################################################################
 
 BOOTTIME = arrow.now()
-UREG = pint.UnitRegistry(autoconvert_offset_to_baseunit=True)
-FAKE = faker.Faker()
 
 ###############################################################################
 # Internal Tools
@@ -97,21 +100,93 @@ def choose(inp):
     return random.choice(options)
 
 
-def get_throw(count, sides):
-    if sides == 'f':
-        die = {-1: '\x034-\x0F', 0: '0', 1: '\x033+\x0F'}
-    else:
-        die = {i: str(i) for i in range(1, int(sides) + 1)}
+MAX_DICE = 100000
+MAX_SIDES = 5000
+# throws with more dice than this draw their sum from the normal
+# approximation instead of rolling every die
+EXACT_DICE = 50
+SHOWN_DICE = 10
+FUDGE = {-1: '\x034-\x0F', 0: '0', 1: '\x033+\x0F'}
+
+
+class Throw(collections.namedtuple('Throw', 'sign count sides explode keep')):
+    """
+    Compiled dice throw, such as 3d6, -2df, 4d6kh3 or 5d10!.
 
-    if count < 0:
-        count = -count
-        die = {-k: v for k, v in die.items()}
+    Keep is None, or a (highest, count) tuple for the kh and kl modifiers.
+    Exploding dice are rolled again, and added up, whenever they show their
+    highest face.
+    """
 
-    results = [random.choice(list(die.keys())) for _ in range(count)]
-    total = sum(results)
-    expanded = ','.join(die[i] for i in results[:10])
+    # fudge dice have no highest face to explode on
+    PATTERN = re.compile(
+        r'([+-]?)(\d*)d(\d+|f)((?<=\d)!)?(?:k([hl]?)(\d+))?$')
+
+    @classmethod
+    def parse(cls, text):
+        sign, count, sides, explode, keep, kept = cls.PATTERN.match(
+            text.lower()).groups()
+        return cls(
+            sign=-1 if sign == '-' else 1,
+            count=int(count) if count else 1,
+            sides=sides if sides == 'f' else int(sides),
+            explode=bool(explode),
+            keep=(keep != 'l', int(kept)) if kept else None)
+
+    @property
+    def faces(self):
+        """Lowest and highest face of a single die."""
+        return (-1, 1) if self.sides == 'f' else (1, self.sides)
+
+    def _die(self):
+        low, high = self.faces
+        face = total = random.randint(low, high)
+        while self.explode and face == high:
+            face = random.randint(low, high)
+            total += face
+        return total
+
+    def _moments(self):
+        """Mean and variance of a single die."""
+        low, high = self.faces
+        n = high - low + 1
+        if not self.explode:
+            return (low + high) / 2, (n ** 2 - 1) / 12
+        # an exploding die is high times the number of explosions, which is
+        # geometric, plus a final roll that is uniform on the other faces
+        mean = high / (n - 1) + (low + high - 1) / 2
+        var = high ** 2 * n / (n - 1) ** 2 + ((n - 1) ** 2 - 1) / 12
+        return mean, var
+
+    def _sample(self, count):
+        """Draw the sum of the dice from the normal approximation."""
+        mean, var = self._moments()
+        total = round(random.gauss(count * mean, math.sqrt(count * var)))
+        low, high = self.faces
+        total = max(total, count * low)
+        return total if self.explode else min(total, count * high)
+
+    def roll(self, expand=False):
+        """
+        Roll the dice. Return the total and the list of faces to display.
+
+        Faces of large throws are only rolled when they are displayed.
+        """
+        if self.keep or self.count <= EXACT_DICE:
+            faces = [self._die() for _ in range(self.count)]
+            kept = faces
+            if self.keep:
+                highest, count = self.keep
+                kept = sorted(faces, reverse=highest)[:count]
+            total, shown = sum(kept), faces[:SHOWN_DICE]
+        else:
+            shown = [self._die() for _ in range(SHOWN_DICE)] if expand else []
+            total = sum(shown) + self._sample(self.count - len(shown))
+        return self.sign * total, shown
 
-    return total, expanded
+    def show(self, faces):
+        return ','.join(
+            FUDGE[i] if self.sides == 'f' else str(i) for i in faces)
 
 
 @core.command
@@ -126,20 +201,21 @@ def dice(inp, *, throws, bonus, text, expand):
     d100 -10d5 +3d20
     3d20 +5 open the door
     3df 2d2
+    4d6kh3 2d20kl1
+    5d10!
     """
     total = 0
     expanded = {}
 
-    for throw in throws:
-        count, sides = throw.split('d')
-        count = int(count) if count else 1
-        if int(count) > 5000:
+    for text in throws:
+        throw = Throw.parse(text)
+        if throw.count > MAX_DICE:
             return lex.dice.too_many_dice
-        if sides != 'f' and not 2 <= int(sides) <= 5000:
+        if throw.sides != 'f' and not 2 <= throw.sides <= MAX_SIDES:
             return lex.dice.bad_side_count
-        subtotal, subexp = get_throw(count, sides)
+        subtotal, faces = throw.roll(expand)
         total += subtotal
-        expanded[throw] = subexp
+        expanded[text] = throw.show(faces)
 
     expanded = ['{}={}'.format(i, expanded[i]) for i in throws]
     expanded = '|'.join(expanded)
@@ -308,14 +384,108 @@ def post_on_twitter():
 ###############################################################################
 
 
-@functools.lru_cache(maxsize=400)
+MEMBERS_LOCK = threading.Lock()
+# number of new member list pages !onpage may fetch for an unknown user
+ONPAGE_PAGES = 3
+
+
 def _members_on_page(page):
+    """Return the number of member list pages, and the members on the page."""
     data = core.wiki._module('membership/MembersListModule', page=page)
-    soup = bs4.BeautifulSoup(data['body'], 'lxml')
-    authors = soup(class_='printuser')
-    authors = [i.text.lower() for i in authors]
-    total = soup.find(class_='pager-no').text.split()[-1]
-    return int(total), authors
+    html = lxml.html.fromstring(data['body'])
+    users = [i.text_content().lower() for i in html.find_class('printuser')]
+    pager = html.find_class('pager-no')
+    total = int(pager[0].text_content().split()[-1]) if pager else 1
+    return total, users
+
+
+def _store_members(pages, start):
+    """Add the members of the (page, users) pairs, numbered from start."""
+    rows = []
+    for page, users in pages:
+        for user in users:
+            rows.append(dict(user=user, page=page, position=start + len(rows)))
+    with db.db.atomic():
+        for idx in range(0, len(rows), 100):
+            db.Member.insert_many(rows[idx:idx + 100]).execute()
+
+
+def _indexed_members(page):
+    return [i.user for i in db.Member.select().where(
+        db.Member.page == page).order_by(db.Member.position)]
+
+
+def _first_changed_page(last, fetch):
+    """
+    Find the first indexed page whose members have changed.
+
+    Members who leave shift everyone after them towards the start of the
+    list, so the unchanged pages are followed by the changed ones, and the
+    boundary is found by a binary search. New members are only added at the
+    end, so the last page is unchanged if it starts with the indexed
+    members. Returns last + 1 if no page has changed.
+    """
+    low, high = 1, last + 1
+    while low < high:
+        page = (low + high) // 2
+        known = _indexed_members(page)
+        users = fetch(page)[1]
+        if page == last:
+            users = users[:len(known)]
+        if users == known:
+            low = page + 1
+        else:
+            high = page
+    return low
+
+
+def update_members(max_pages=None):
+    """
+    Bring the local member index up to date.
+
+    The members are listed in the order in which they joined. Only the
+    pages from the first one whose members changed are fetched again, and
+    the pages after the last indexed one are fetched for the new members.
+
+    If max_pages is given, only the new members are looked for, on at most
+    that many new pages. If members have left, the index is left as it is,
+    for the next full update.
+    """
+    with MEMBERS_LOCK:
+        last = db.Member.select(peewee.fn.Max(db.Member.page)).scalar() or 0
+        fetched = {}
+
+        def fetch(page):
+            if page not in fetched:
+                fetched[page] = _members_on_page(page)
+            return fetched[page]
+
+        if not last:
+            first = 1
+        elif max_pages:
+            known = _indexed_members(last)
+            if fetch(last)[1][:len(known)] != known:
+                return
+            first = last + 1
+        else:
+            first = _first_changed_page(last, fetch)
+
+        total = fetch(min(first, last) or 1)[0]
+        pages = []
+        if first > last and last:
+            known = _indexed_members(last)
+            pages.append((last, fetch(last)[1][len(known):]))
+        end = total if not max_pages else min(total, first + max_pages - 1)
+        pages.extend((page, fetch(page)[1]) for page in range(first, end + 1))
+
+        with db.db.atomic():
+            db.Member.delete().where(db.Member.page >= first).execute()
+            _store_members(pages, db.Member.select().count())
+
+
+def start_members():
+    """Update the member index in the background."""
+    threading.Thread(target=update_members, daemon=True).start()
 
 
 @core.command
@@ -325,20 +495,19 @@ def onpage(inp, user, oldest_first):
     """
     Find the member list page on which the given user appears.
 
-    Iterates over the member lists until it find the required user.
-    Be default, starts with the newest members and continues back in time.
+    Looks the user up in the local index of the member list. If the user
+    isn't in it, the few newest pages of the member list are checked, in
+    case they joined recently.
     """
-    yield lex.onpage.working
-    total, _ = _members_on_page(1)
-    pages = range(1, total + 1)
-    if not oldest_first:
-        pages = reversed(pages)
-
-    for page in pages:
-        if user in _members_on_page(page)[1]:
-            yield lex.onpage.found(user=user, page=page)
-            return
-    yield lex.onpage.not_found(user=user)
+    member = db.Member.find_one(user=user)
+    if not member:
+        yield lex.onpage.working
+        update_members(max_pages=ONPAGE_PAGES)
+        member = db.Member.find_one(user=user)
+    if member:
+        yield lex.onpage.found(user=user, page=member.page)
+    else:
+        yield lex.onpage.not_found(user=user)
 
 
 @core.command
@@ -354,6 +523,47 @@ def mylevel(inp):
 ###############################################################################
 
 
+@functools.lru_cache()
+def get_unit_registry():
+    """Build the unit registry on first use, since it's slow to load."""
+    return pint.UnitRegistry(autoconvert_offset_to_baseunit=True)
+
+
+@functools.lru_cache(maxsize=1000)
+def _conversion_plan(source, destination):
+    """
+    Parse the units and find the factor between them.
+
+    Return the factor and the parsed destination units, or None if the
+    units have an offset, like degrees Celsius, and can't be converted by
+    a factor alone.
+    """
+    ureg = get_unit_registry()
+    source = ureg.parse_units(source)
+    destination = ureg.parse_units(destination)
+    if ureg.Quantity(0, source).to(destination).magnitude != 0:
+        return None
+    return ureg.Quantity(1, source).to(destination).magnitude, destination
+
+
+def _convert(source, destination):
+    value, _, units = source.partition(' ')
+    try:
+        plan = _conversion_plan(units, destination)
+    except Exception:
+        plan = None
+    ureg = get_unit_registry()
+    if not plan:
+        # let pint handle the offset units, and word the errors
+        return ureg(source).to(destination)
+    try:
+        value = int(value)
+    except ValueError:
+        value = float(value)
+    factor, units = plan
+    return ureg.Quantity(value * factor, units)
+
+
 @core.command
 @core.alias('cv')
 @parser.convert
@@ -371,7 +581,7 @@ def convert(inp, *, expression, precision):
     except (IndexError, ValueError):
         return lex.convert.syntax_error
     try:
-        result = UREG(source).to(destination)
+        result = _convert(source, destination)
     except Exception as e:
         return lex.convert.conversion_error(text=str(e))
 
@@ -404,6 +614,11 @@ def convert(inp, *, expression, precision):
 ###############################################################################
 
 
+@functools.lru_cache()
+def get_faker():
+    return faker.Faker()
+
+
 @core.command
 @parser.name
 def name(inp, mode, **kwargs):
@@ -421,17 +636,17 @@ def name_person(inp, *, male, female, first, last, prefix, suffix):
     nametype = 'first' if first else 'last' if last else ''
     gender = 'male' if male else 'female' if female else ''
     attr = '{}_name_{}'.format(nametype, gender).strip('_')
-    name = getattr(FAKE, attr)()
+    name = getattr(get_faker(), attr)()
 
     if prefix:
         attr = 'prefix_{}'.format(gender).strip('_')
-        prefix = getattr(FAKE, attr)()
+        prefix = getattr(get_faker(), attr)()
     else:
         prefix = None
 
     if suffix:
         attr = 'suffix_{}'.format(gender).strip('_')
-        suffix = getattr(FAKE, attr)()
+        suffix = getattr(get_faker(), attr)()
     else:
         suffix = None
 
@@ -5,6 +5,8 @@
 ###############################################################################
 
 import jinja2
+import threading
+import time
 
 ###############################################################################
 # Jinja2
@@ -66,3 +68,23 @@ def catch(exceptions, return_value=None):
         return inner
 
     return decorator
+
+
+###############################################################################
+
+
+class RateLimiter:
+    """Space out the calls to wait() by at least the given interval."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next = 0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern word filter.
+
+Finds any word from a word list in a text in a single pass over the text,
+using the Aho-Corasick algorithm. Both the words and the text are normalized
+first, so that leetspeak doesn't hide the word. Separators are left in
+place, and words are only found within a single run of letters: joining
+the parts of "Dash_It" would find words that aren't there.
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import collections
+import pathlib
+import re
+
+###############################################################################
+# Normalization
+###############################################################################
+
+WORDLISTS = pathlib.Path(__file__).parent / 'resources/wordlists'
+
+LEET = str.maketrans({
+    '0': 'o', '1': 'i', '!': 'i', '|': 'i', '3': 'e', '4': 'a', '@': 'a',
+    '5': 's', '$': 's', '7': 't', '+': 't', '8': 'b', '9': 'g'})
+
+
+def normalize(text):
+    """Lowercase, undo leetspeak, turn other non-letters into spaces."""
+    text = text.lower().translate(LEET)
+    return re.sub(r'[^a-z]+', ' ', text).strip()
+
+
+###############################################################################
+# Automaton
+###############################################################################
+
+
+class Automaton:
+    """Aho-Corasick automaton matching a fixed set of words."""
+
+    def __init__(self, words):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [()]
+        for word in words:
+            self._add(word)
+        self._link()
+
+    def _add(self, word):
+        state = 0
+        for char in word:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state] = (word,)
+
+    def _link(self):
+        """Compute the failure links breadth-first."""
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[child] = self.goto[fail].get(char, 0)
+                # words ending at the failure state also end here
+                self.output[child] += self.output[self.fail[child]]
+
+    def search(self, text):
+        """Return the first word found in the text, or None."""
+        for word in self.iter(text):
+            return word
+
+    def iter(self, text):
+        """Yield the words found in the text, in the order they end."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            yield from output[state]
+
+
+###############################################################################
+# Word Filter
+###############################################################################
+
+
+class WordFilter:
+    """Finds words from the word list in arbitrary text, such as nicks."""
+
+    def __init__(self, words):
+        self.words = {normalize(i): i for i in words if normalize(i)}
+        self.automaton = Automaton(sorted(self.words))
+
+    @classmethod
+    def from_file(cls, path):
+        """Load the word list, one word per line, '#' starts a comment."""
+        with pathlib.Path(path).open(encoding='utf-8') as file:
+            lines = [i.split('#')[0].strip() for i in file]
+        return cls(i for i in lines if i)
+
+    def search(self, text):
+        """Return the first listed word found in the text, or None."""
+        for token in normalize(text).split():
+            word = self.automaton.search(token)
+            if word:
+                return self.words[word]
+
+    def __contains__(self, text):
+        return self.search(text) is not None
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Benchmark the author stats chart rendering.
+
+Renders the charts for synthetic authors with the given numbers of pages,
+using both the current renderer and the original one based on textwrap and
+dominate. Checks that the outputs are identical, and prints the timings.
+
+Usage: scripts/bench_charts.py [PAGES...]
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import collections
+import random
+import sys
+import textwrap
+import timeit
+
+from dominate import tags as dt
+
+from jarvis import stats
+
+###############################################################################
+
+Meta = collections.namedtuple('Meta', 'role date')
+
+
+class Page:
+
+    def __init__(self, idx, user):
+        self.title = 'SCP-{} - The "Thing" & <Other> Thing'.format(idx)
+        self.url = 'http://www.scp-wiki.net/scp-{}'.format(idx)
+        self.rating = random.randint(-20, 500)
+        self.tags = set(random.sample(
+            ['scp', 'tale', 'hub', 'euclid', 'keter', 'humanoid'], 3))
+        self.created = '2016-01-{:02d} 12:00:00'.format(idx % 28 + 1)
+        self.metadata = {user: Meta('author', self.created)}
+
+
+def legacy_render(chart):
+
+    def format_row(row, indent):
+        row = ',\n'.join(map(repr, row))
+        row = textwrap.indent(row, '    ')
+        row = '[\n{}\n]'.format(row)
+        return textwrap.indent(row, ' ' * indent)
+
+    data = ',\n'.join([format_row(r, 8) for r in chart.data])
+    return stats.CHART.format(
+        name=chart.name,
+        class_name=chart.class_name,
+        data=data,
+        options=chart.options)
+
+
+def legacy_tooltips(chart, pages):
+    for row, p in zip(chart.data[1:], pages):
+        date = p.metadata[chart.user].date[:10] or '-'
+        row[2] = dt.table(
+            dt.tr(dt.td(p.title, colspan=2)),
+            dt.tr(dt.td('Rating:'), dt.td(p.rating)),
+            dt.tr(dt.td('Created:'), dt.td(date)),
+            cls='articles_chart_tooltip').render(pretty=False)
+
+
+def benchmark(count, number=20):
+    user = 'test-user'
+    pages = [Page(i, user) for i in range(count)]
+
+    def current():
+        return [
+            stats.ArticlesChart(pages, user).render(),
+            stats.ArticlesTable(pages, user).render()]
+
+    def legacy():
+        chart = stats.ArticlesChart(pages, user)
+        legacy_tooltips(chart, pages)
+        return [
+            legacy_render(chart),
+            legacy_render(stats.ArticlesTable(pages, user))]
+
+    assert current() == legacy(), 'The outputs differ.'
+    new = timeit.timeit(current, number=number) / number
+    old = timeit.timeit(legacy, number=number) / number
+    print('{:>6} pages: {:8.2f}ms -> {:8.2f}ms ({:.1f}x)'.format(
+        count, old * 1000, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    for count in map(int, sys.argv[1:] or [10, 100, 1000]):
+        benchmark(count)
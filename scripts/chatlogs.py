@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Bulk import and export of IRC logs.
+
+Importing drops the message indexes for the duration of the import, so the
+bot should be stopped while the script is running.
+
+The script doesn't need the bot's credentials or network access. The
+database paths are read from the database section of config.yaml, if
+there is one, and can be overridden with the --db and --logs options.
+
+Usage:
+    scripts/chatlogs.py import FORMAT CHANNEL FILE... [--offset=HOURS]
+    scripts/chatlogs.py export FORMAT CHANNEL [OUTPUT]
+    (both accept [--db=PATH] [--logs=PATH])
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import pathlib
+import sys
+import types
+import yaml
+
+###############################################################################
+
+# importing the jarvis package loads the whole bot, which needs the config,
+# the wiki credentials and the network; the log tools only need the
+# database layer, so the package is set up without running its __init__
+_package = types.ModuleType('jarvis')
+_package.__path__ = [
+    str(pathlib.Path(__file__).resolve().parents[1] / 'jarvis')]
+sys.modules['jarvis'] = _package
+
+import jarvis.chatlogs  # noqa: E402
+import jarvis.db  # noqa: E402
+
+###############################################################################
+
+
+def init_db(opts):
+    config = {}
+    if pathlib.Path('config.yaml').exists():
+        with open('config.yaml') as file:
+            config = yaml.safe_load(file) or {}
+    dbconfig = config.get('database') or {}
+    logconfig = dbconfig.get('logs') or {}
+    jarvis.db.init(
+        opts.get('db') or dbconfig.get('path', 'jarvis.db'),
+        pragmas=dbconfig.get('pragmas'),
+        timeout=dbconfig.get('timeout', 30),
+        logs=opts.get('logs') or logconfig.get('path'),
+        log_pragmas=logconfig.get('pragmas'),
+        nick=(config.get('irc') or {}).get('nick'))
+
+
+def run_import(fmt, channel, *paths, offset=0):
+    records = jarvis.chatlogs.parse(paths, fmt, offset)
+    count, seconds = 0, 0
+    for count, seconds in jarvis.chatlogs.import_logs(records, channel):
+        print('{} messages, {:.0f}/s'.format(
+            count, count / max(seconds, 0.001)), end='\r', flush=True)
+    print('imported {} messages in {:.1f}s'.format(count, seconds))
+    jarvis.chatlogs.drop_chains(channel)
+
+
+def run_export(fmt, channel, output=None):
+    if not output:
+        jarvis.chatlogs.export_logs(sys.stdout, channel, fmt)
+        return
+    with open(output, 'w', encoding='utf-8') as file:
+        count = jarvis.chatlogs.export_logs(file, channel, fmt)
+    print('exported {} lines'.format(count))
+
+
+if __name__ == '__main__':
+    args = [i for i in sys.argv[1:] if not i.startswith('--')]
+    opts = dict(i[2:].split('=', 1) for i in sys.argv[1:] if '=' in i)
+    if len(args) >= 4 and args[0] == 'import':
+        init_db(opts)
+        run_import(*args[1:], offset=float(opts.get('offset', 0)))
+    elif 3 <= len(args) <= 4 and args[0] == 'export':
+        init_db(opts)
+        run_export(*args[1:])
+    else:
+        sys.exit(__doc__.strip().split('\n\n')[-1])
@@ -73,4 +73,4 @@ for page, urls in sorted(images.items()):
         print(page, urls)
         raise e
 
-
+jarvis.images.WRITER.flush()
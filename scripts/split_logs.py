@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Move the message logs out of the main jarvis database.
+
+Copies the Message table and the log archive tables into a separate
+database file, then drops them from the main database. The activity
+rollups are dropped as well, and the log migrations are marked as not yet
+applied, so that the bot rebuilds the rollups in the new file from all the
+moved messages when it's started. The bot must be stopped while the script
+is running. Afterwards, set 'database.logs.path' in config.yaml to the
+path of the new file.
+
+Usage: scripts/split_logs.py jarvis.db logs.db [--vacuum]
+"""
+
+###############################################################################
+# Module Imports
+###############################################################################
+
+import re
+import sqlite3
+import sys
+import time
+
+###############################################################################
+
+ROLLUPS = ('activity', 'talker')
+
+###############################################################################
+
+
+def log_tables(conn, schema='main'):
+    query = (
+        "SELECT name FROM {}.sqlite_master WHERE type = 'table' AND "
+        "(name = 'message' OR name LIKE 'message_archive_%')")
+    return [i[0] for i in conn.execute(query.format(schema))]
+
+
+def has_table(conn, table, schema='main'):
+    query = (
+        "SELECT 1 FROM {}.sqlite_master WHERE type = 'table' AND name = ?")
+    return bool(conn.execute(query.format(schema), (table,)).fetchall())
+
+
+def schema_sql(conn, table):
+    """Return the table and index definitions, qualified for 'logs'."""
+    query = (
+        'SELECT type, sql FROM main.sqlite_master '
+        'WHERE tbl_name = ? AND sql IS NOT NULL')
+    for kind, sql in conn.execute(query, (table,)):
+        if kind == 'table':
+            yield re.sub(
+                r'^CREATE TABLE\s+', 'CREATE TABLE IF NOT EXISTS logs.', sql)
+        elif kind == 'index':
+            yield re.sub(
+                r'^CREATE (UNIQUE )?INDEX\s+',
+                r'CREATE \1INDEX IF NOT EXISTS logs.', sql)
+
+
+def split(source, target, vacuum=False):
+    conn = sqlite3.connect(source, isolation_level=None)
+    conn.execute('ATTACH DATABASE ? AS logs', (target,))
+    conn.execute('PRAGMA logs.journal_mode = WAL')
+
+    for table in log_tables(conn):
+        start = time.time()
+        existing = table in log_tables(conn, 'logs')
+
+        conn.execute('BEGIN')
+        for sql in schema_sql(conn, table):
+            conn.execute(sql)
+        columns = [i[1] for i in conn.execute(
+            'PRAGMA main.table_info("{}")'.format(table))]
+        if existing:
+            # the bot has already logged into the new file, so the ids
+            # of the old messages can't be preserved
+            columns = [i for i in columns if i != 'id']
+        columns = ', '.join('"{}"'.format(i) for i in columns)
+        count = conn.execute(
+            'INSERT INTO logs."{0}" ({1}) SELECT {1} FROM main."{0}"'
+            .format(table, columns)).rowcount
+        conn.execute('DROP TABLE main."{}"'.format(table))
+        conn.execute('COMMIT')
+
+        print('{}: moved {} rows in {:.1f}s'.format(
+            table, count, time.time() - start))
+
+    conn.execute('BEGIN')
+    for table in ROLLUPS:
+        conn.execute('DROP TABLE IF EXISTS main."{}"'.format(table))
+    for schema in ('main', 'logs'):
+        if has_table(conn, 'schemaversion', schema):
+            conn.execute(
+                "DELETE FROM {}.schemaversion WHERE name = 'logs'".format(
+                    schema))
+    conn.execute('COMMIT')
+
+    conn.execute('DETACH DATABASE logs')
+    if vacuum:
+        conn.execute('VACUUM')
+    conn.close()
+
+
+if __name__ == '__main__':
+    args = [i for i in sys.argv[1:] if not i.startswith('--')]
+    if len(args) != 2:
+        sys.exit(__doc__.strip().split('\n')[-1])
+    split(*args, vacuum='--vacuum' in sys.argv)
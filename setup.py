@@ -25,7 +25,8 @@ setuptools.setup(
         'lexicon.yaml',
         'resources/help.template',
         'resources/lexicon/*',
-        'resources/templates/*']},
+        'resources/templates/*',
+        'resources/wordlists/*']},
     tests_require=[
         'pytest>=3.0.2',
         'pytest-cov',
@@ -36,6 +37,7 @@ setuptools.setup(
         'google-api-python-client',
         'jinja2',
         'logbook',
+        'lxml',
         'markovify',
         'natural',
         'oauth2client==3.0.0',